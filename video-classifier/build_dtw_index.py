@@ -0,0 +1,415 @@
+#!/opt/anaconda3/bin/python
+
+"""
+Builds a `knn_dtw.KnnDtw` index from the labeled pose timeseries, with
+the numerosity reduction of Xi, Keogh et al., "Fast Time Series
+Classification Using Numerosity Reduction" (ICML 2006):
+
+1. For each candidate warping window, the nearest neighbor of every
+   reference among the references of each class is found with the
+   pruned search of `KnnDtw.nearest_neighbors` (LB_Kim, LB_Keogh and
+   early abandoning), so the distances of all pairs are never computed.
+2. A warping window is learned for each class, which maximizes the
+   leave-one-out 1-NN accuracy over the whole dataset when comparing with
+   the references of that class.
+3. References are ranked by how they contribute to the leave-one-out
+   1-NN classification of all others (+1 for each one they classify
+   correctly, -2 for each one they misclassify), and the lowest ranked
+   are dropped one by one until each class has at most
+   `max_per_class` references. Ties are broken by dropping the reference
+   whose neighbors are the furthest away. References which lose their
+   nearest neighbor search for the next one.
+4. As the best window depends on the number of references, the nearest
+   neighbors among the references which are left are found again, and
+   the windows are learned again from them.
+
+Memory is proportional to the number of references times the number of
+classes and windows, so tens of thousands of references are fine.
+
+The index is saved as a compact .npz file, which `KnnDtw.load` reads
+without unpickling. Since the number of references is capped per class,
+the cost of a query stays the same as more reps are recorded.
+
+Example:
+  ./build_dtw_index.py --output data/dtw_index.npz --max-per-class 20
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+
+import time
+import argparse
+import multiprocessing
+
+import numpy as np
+
+from knn_dtw import KnnDtw
+from load_dataset import load_exercise_timeseries
+
+
+_REFERENCE_DIR = 'data/timeseries'
+_LABEL_MAP_PATH = 'data/exercises_label_map.txt'
+_INDEX_PATH = 'data/dtw_index.npz'
+
+_MIN_CONFIDENCE = 0.08
+_MAX_PER_CLASS = 20
+# Candidate windows, as fractions of the median length of the timeseries
+_WINDOW_FRACTIONS = (0.0, 0.02, 0.05, 0.1, 0.2, 0.3, 0.5, 0.7)
+# Number of queries searched by a worker process at a time
+_BLOCK_SIZE = 64
+
+
+def candidate_windows(lengths, fractions=_WINDOW_FRACTIONS):
+  """Returns the distinct windows, in samples, for fractions of the median length."""
+
+  median = np.median(lengths)
+  return sorted(set(int(round(f * median)) for f in fractions))
+
+
+class ClassNeighbors(object):
+  """
+  Searches the nearest neighbors of references among the references of
+  each class, with each of the candidate windows, without computing the
+  distances of all pairs. There is a `KnnDtw` per class and window, so
+  that each search prunes candidates with the lower bounds of its own
+  window. A reference is never its own neighbor.
+
+  Parameters:
+  - references: a list of timeseries of shape (num_samples, num_body_parts, 3)
+  - labels: the class index of each reference
+  - num_classes: number of classes
+  - windows: the candidate windows, in samples
+  - kept: boolean mask of the references which may be neighbors (default: all)
+  """
+
+  def __init__(self, references, labels, num_classes, windows, kept=None,
+               min_confidence=_MIN_CONFIDENCE):
+    self.references = references
+    self.labels = np.asarray(labels)
+    self.num_classes = num_classes
+    self.windows = windows
+    self.kept = np.ones(len(references), dtype=bool) if kept is None else np.asarray(kept)
+
+    # The index of each (window, class), and the reference of each of its entries
+    self._indexes = {}
+    for c in range(num_classes):
+      members = np.flatnonzero((self.labels == c) & self.kept)
+      if len(members):
+        for w, window in enumerate(windows):
+          index = KnnDtw([references[j] for j in members], np.zeros(len(members), dtype=int),
+                         window=window, min_confidence=min_confidence)
+          self._indexes[w, c] = (index, members)
+
+  def neighbors(self, i, w, c, k=1, max_distance=np.inf):
+    """
+    Returns up to `k` (distance, reference) tuples of the references of
+    class `c` closest to reference `i` with window `w` (an index into
+    `windows`), sorted from the closest. Only references closer than
+    `max_distance` are returned.
+    """
+
+    if (w, c) not in self._indexes:
+      return []
+    index, members = self._indexes[w, c]
+    own = self.labels[i] == c and self.kept[i]
+    found = index.nearest_neighbors(self.references[i], k=k + own, max_distance=max_distance)
+    return [(dist, int(members[j])) for dist, j in found if members[j] != i][:k]
+
+  def nearest(self, processes=None, block_size=_BLOCK_SIZE):
+    """
+    Finds the nearest neighbor of every reference in every class, with
+    every window, on a pool of `processes` processes (defaults to # CPUs),
+    or in this process if `processes` is 1.
+
+    Whether a reference is classified correctly by its nearest neighbor
+    only depends on the neighbors of other classes which are at most as
+    far as its nearest neighbor in its own class, with any window. Other
+    classes are only searched below that limit, which prunes most of them.
+
+    Returns:
+    - (distances, neighbors, limits): arrays of shape (len(windows), N,
+      num_classes) with the distance to the nearest neighbor and its
+      index, which are `inf` and -1 if there is none below the limit, and
+      the limit of each reference and class, of shape (N, num_classes).
+    """
+
+    n = len(self.references)
+    shape = (len(self.windows), n, self.num_classes)
+    distances, neighbors = np.full(shape, np.inf), np.full(shape, -1)
+    limits = np.full((n, self.num_classes), np.inf)
+
+    tasks = [np.arange(start, min(start + block_size, n)) for start in range(0, n, block_size)]
+    for queries, block in zip(tasks, self._map(_nearest_block, tasks, processes)):
+      for i, (nearest, limit) in zip(queries, block):
+        limits[i] = limit
+        for (w, c), (dist, j) in nearest.items():
+          distances[w, i, c], neighbors[w, i, c] = dist, j
+    return distances, neighbors, limits
+
+  def _nearest_in_class(self, i, c, limit):
+    """Returns the nearest neighbor of `i` in class `c` below `limit` for each window, or None."""
+
+    nearest, bound = [], limit
+    for w in range(len(self.windows)):
+      # A wider window never increases a distance, so the distance with the
+      # previous (narrower) window bounds the search with this one
+      found = self.neighbors(i, w, c, max_distance=bound)
+      if not found and bound < limit:
+        # Rounding may make the bound a hair too tight
+        found = self.neighbors(i, w, c, max_distance=limit)
+      nearest.append(found[0] if found else None)
+      if found:
+        bound = min(np.nextafter(found[0][0], np.inf), limit)
+    return nearest
+
+  def _nearest_of(self, i):
+    own = self.labels[i]
+    limit = np.full(self.num_classes, np.inf)
+    nearest = {}
+    for c in [own] + [c for c in range(self.num_classes) if c != own]:
+      found = self._nearest_in_class(i, c, limit[c])
+      nearest.update(((w, c), f) for w, f in enumerate(found) if f is not None)
+      if c == own:
+        # Neighbors exactly as near as the limit are found too, in case of ties.
+        # Without any in its own class, a reference is misclassified anyway.
+        own_distances = [f[0] for f in found if f is not None]
+        limit[np.arange(self.num_classes) != own] = \
+          np.nextafter(max(own_distances), np.inf) if own_distances else 0.0
+    return nearest, limit
+
+  def _map(self, function, tasks, processes):
+    if processes == 1:
+      _init_worker(self)
+      try:
+        return [function(task) for task in tasks]
+      finally:
+        _init_worker(None)
+
+    # Each process gets a copy of the indexes once, not with every task
+    pool = multiprocessing.Pool(processes=processes, initializer=_init_worker, initargs=(self, ))
+    try:
+      return pool.map(function, tasks)
+    finally:
+      pool.close()
+      pool.join()
+
+
+_worker_search = None
+
+
+def _init_worker(search):
+  global _worker_search
+  _worker_search = search
+
+
+def _nearest_block(queries):
+  return [_worker_search._nearest_of(i) for i in queries]
+
+
+def _class_distances(distances, class_windows):
+  """Selects, for each class (column), the nearest distances with the window of that class."""
+
+  return distances[class_windows, :, np.arange(len(class_windows))].T
+
+
+def loo_accuracy(distances, labels):
+  """
+  Returns the leave-one-out 1-NN accuracy of all references. `distances`
+  has shape (N, num_classes) with the distance of reference i to its
+  nearest neighbor in class c.
+  """
+
+  nearest = np.argmin(distances, axis=1)
+  found = np.isfinite(distances[np.arange(len(labels)), nearest])
+  return np.mean(found & (nearest == labels))
+
+
+def learn_class_windows(distances, labels, num_classes, num_passes=2):
+  """
+  Learns the window of each class by coordinate ascent on the
+  leave-one-out accuracy, preferring the narrowest window on ties.
+
+  Parameters:
+  - distances: array of shape (num_windows, N, num_classes) from `ClassNeighbors.nearest`
+  - labels: the class index of each reference
+  - num_classes: number of classes
+
+  Returns:
+  - An array with, for each class, the index of its window.
+  """
+
+  # Start with the window which is best for all classes at once
+  scores = [loo_accuracy(d, labels) for d in distances]
+  class_windows = np.full(num_classes, int(np.argmax(scores)))
+
+  for _ in range(num_passes):
+    changed = False
+    for c in np.unique(labels):
+      scores = []
+      for w in range(len(distances)):
+        class_windows[c] = w
+        scores.append(loo_accuracy(_class_distances(distances, class_windows), labels))
+      best = int(np.argmax(scores))
+      changed |= best != class_windows[c]
+      class_windows[c] = best
+    if not changed:
+      break
+
+  return class_windows
+
+
+def reduce_references(search, distances, neighbors, limits, class_windows, max_per_class):
+  """
+  Drops the lowest ranked references until no class has more than
+  `max_per_class` of them, updating the nearest neighbor of the
+  references which lost theirs after each drop.
+
+  Parameters:
+  - search: the `ClassNeighbors` of all references
+  - distances, neighbors, limits: the results of `search.nearest()`
+  - class_windows: the index of the window of each class
+
+  Returns:
+  - A boolean mask of the references which are kept.
+  """
+
+  labels = search.labels
+  n, num_classes = len(labels), len(class_windows)
+  kept = np.ones(n, dtype=bool)
+  counts = np.bincount(labels, minlength=num_classes)
+
+  # The next kept candidates of each reference in each class, sorted from the
+  # closest, and whether there are no more below the limit of the class
+  limits = limits.copy()
+  candidates = [[[(d, j)] if j >= 0 else [] for d, j in zip(dists, idxs)] for dists, idxs in zip(
+    _class_distances(distances, class_windows), _class_distances(neighbors, class_windows))]
+  exhausted = _class_distances(neighbors, class_windows) < 0
+
+  def _head(i, c):
+    """
+    Returns the (distance, index) of the nearest kept neighbor of `i` in
+    class `c`, or (limit, -1) if there is none below the limit.
+    """
+
+    found = candidates[i][c]
+    while found and not kept[found[0][1]]:
+      found.pop(0)
+    if not found and not exhausted[i, c]:
+      # More than the dropped references of the class are needed to find a kept one
+      k = 2 * np.count_nonzero(~kept & (labels == c)) + 1
+      found[:] = [(d, j) for d, j in search.neighbors(i, class_windows[c], c, k=k,
+                                                      max_distance=limits[i, c]) if kept[j]]
+      exhausted[i, c] = not found
+    return found[0] if found else (limits[i, c], -1)
+
+  def _nearest(i):
+    heads = [_head(i, c) for c in range(num_classes)]
+    best = min((head for head in heads if head[1] >= 0), default=(np.inf, -1))
+    # A class searched below a limit may have a nearer neighbor beyond it
+    beyond = [c for c, (limit, j) in enumerate(heads) if j < 0 and limit <= best[0] and limit < np.inf]
+    if not beyond:
+      return best
+    for c in beyond:
+      limits[i, c], exhausted[i, c] = np.inf, False
+    return _nearest(i)
+
+  nearest_dist, nearest = (np.array(x) for x in zip(*[_nearest(i) for i in range(n)]))
+
+  while (counts > max_per_class).any():
+    # Queries without any comparable reference do not rank anything
+    found = np.isfinite(nearest_dist)
+    votes = np.where(labels[nearest] == labels, 1, -2)[found]
+    rank = np.bincount(nearest[found], weights=votes, minlength=n)
+    with np.errstate(divide='ignore'):
+      priority = np.bincount(nearest[found], weights=1 / nearest_dist[found] ** 2, minlength=n)
+
+    droppable = kept & (counts[labels] > max_per_class)
+    droppable_idx = np.flatnonzero(droppable)
+    dropped = droppable_idx[np.lexsort((priority[droppable_idx], rank[droppable_idx]))[0]]
+
+    kept[dropped] = False
+    counts[labels[dropped]] -= 1
+
+    # Only the queries whose nearest neighbor was dropped need a new one
+    for i in np.flatnonzero(nearest == dropped):
+      nearest_dist[i], nearest[i] = _nearest(i)
+
+  return kept
+
+
+def build_index(references, labels, num_classes, max_per_class=_MAX_PER_CLASS,
+                window_fractions=_WINDOW_FRACTIONS, min_confidence=_MIN_CONFIDENCE,
+                processes=None):
+  """
+  Builds a numerosity-reduced `KnnDtw` index with a learned window per
+  class (see the module docstring).
+
+  Returns:
+  - (index, kept, report): the index, the boolean mask of the references
+    it contains, and a dictionary with the windows and leave-one-out
+    accuracies before and after the reduction.
+  """
+
+  labels = np.asarray(labels)
+  windows = candidate_windows([len(r) for r in references], window_fractions)
+  search = ClassNeighbors(references, labels, num_classes, windows, min_confidence=min_confidence)
+  distances, neighbors, limits = search.nearest(processes=processes)
+
+  class_windows = learn_class_windows(distances, labels, num_classes)
+  before = loo_accuracy(_class_distances(distances, class_windows), labels)
+
+  kept = reduce_references(search, distances, neighbors, limits, class_windows, max_per_class)
+
+  search = ClassNeighbors(references, labels, num_classes, windows, kept=kept,
+                          min_confidence=min_confidence)
+  distances, _, _ = search.nearest(processes=processes)
+  class_windows = learn_class_windows(distances, labels, num_classes)
+  after = loo_accuracy(_class_distances(distances, class_windows), labels)
+
+  window = [windows[w] for w in class_windows]
+  index = KnnDtw([r for r, k in zip(references, kept) if k], labels[kept],
+                 window=window, min_confidence=min_confidence)
+
+  report = {
+    'candidate_windows': windows,
+    'class_windows': window,
+    'num_references': len(labels),
+    'num_kept': int(kept.sum()),
+    'accuracy_before': float(before),
+    'accuracy_after': float(after)
+  }
+  return index, kept, report
+
+
+def _parse_args():
+  parser = argparse.ArgumentParser(description='Build a numerosity-reduced kNN-DTW index.')
+  parser.add_argument('--reference-dir', default=_REFERENCE_DIR)
+  parser.add_argument('--label-map', default=_LABEL_MAP_PATH)
+  parser.add_argument('--output', default=_INDEX_PATH)
+  parser.add_argument('--max-per-class', type=int, default=_MAX_PER_CLASS)
+  parser.add_argument('--window-fractions', nargs='+', type=float, default=list(_WINDOW_FRACTIONS),
+                      help='candidate windows, as fractions of the median length')
+  parser.add_argument('--min-confidence', type=float, default=_MIN_CONFIDENCE)
+  parser.add_argument('--processes', type=int, default=None,
+                      help='number of worker processes for the distances (default: # CPUs)')
+  return parser.parse_args()
+
+
+if __name__ == '__main__':
+  args = _parse_args()
+
+  X, y, _ = load_exercise_timeseries(args.reference_dir, args.label_map)
+  classes = [x.strip() for x in open(args.label_map)]
+
+  start = time.time()
+  index, kept, report = build_index(X, y, len(classes), max_per_class=args.max_per_class,
+                                    window_fractions=args.window_fractions,
+                                    min_confidence=args.min_confidence, processes=args.processes)
+  index.save(args.output)
+
+  for c, name in enumerate(classes):
+    print('%-24s window %4d, %4d of %4d references' % (
+      name, report['class_windows'][c], np.sum(kept & (np.asarray(y) == c)), np.sum(np.asarray(y) == c)))
+  print('Leave-one-out 1-NN accuracy: %.3f with all references, %.3f with the index' % (
+    report['accuracy_before'], report['accuracy_after']))
+  print('Index of %d references written to %s in %.1fs' % (report['num_kept'], args.output, time.time() - start))
@@ -3,13 +3,43 @@ import tensorflow as tf
 import sonnet as snt
 
 import i3d
+from process_video import NUM_FRAMES, IMAGE_SIZE
 
 
 NUM_CLASSES = 6
-NUM_FRAMES = 140
-IMAGE_SIZE = 224
+FINAL_ENDPOINT = 'Mixed_5c'
 
-_BATCH_SIZE = 1
+# The 'training' checkpoint path is formatted with `config_name`
+CHECKPOINT_PATHS = {
+  'rgb_imagenet': 'data/checkpoints/rgb_imagenet/model.ckpt',
+  'flow_imagenet': 'data/checkpoints/flow_imagenet/model.ckpt',
+  'training': 'data/checkpoints/training{}/model.ckpt'
+}
+
+# Graph collection of the variables of the trainable heads, which the training checkpoint holds
+HEAD_VARIABLES = 'head_variables'
+# Graph collection of the optimizer of the training graph
+OPTIMIZER = 'optimizer'
+
+# Endpoints of the backbone with their (temporal, spatial) stride and channels
+_ENDPOINTS = (
+  ('Conv3d_1a_7x7', (2, 2), 64),
+  ('MaxPool3d_2a_3x3', (1, 2), 64),
+  ('Conv3d_2b_1x1', (1, 1), 64),
+  ('Conv3d_2c_3x3', (1, 1), 192),
+  ('MaxPool3d_3a_3x3', (1, 2), 192),
+  ('Mixed_3b', (1, 1), 256),
+  ('Mixed_3c', (1, 1), 480),
+  ('MaxPool3d_4a_3x3', (2, 2), 480),
+  ('Mixed_4b', (1, 1), 512),
+  ('Mixed_4c', (1, 1), 512),
+  ('Mixed_4d', (1, 1), 512),
+  ('Mixed_4e', (1, 1), 528),
+  ('Mixed_4f', (1, 1), 832),
+  ('MaxPool3d_5a_2x2', (2, 2), 832),
+  ('Mixed_5b', (1, 1), 832),
+  ('Mixed_5c', (1, 1), 1024)
+)
 
 
 def _variable_summaries(var):
@@ -23,25 +53,55 @@ def _variable_summaries(var):
   tf.summary.histogram('histogram', var)
 
 
-def _build_stream(stream_name, is_training):
-  dims = 3 if stream_name is 'RGB' else 2
-  input_shape = (_BATCH_SIZE, NUM_FRAMES, IMAGE_SIZE, IMAGE_SIZE, dims)
-  inp = tf.placeholder(tf.float32, shape=input_shape)
+def _build_backbone(stream_name, batch_size, fold_batch_norm=False, final_endpoint=FINAL_ENDPOINT,
+                    num_frames=NUM_FRAMES, image_size=IMAGE_SIZE):
+  """
+  Builds the pre-trained I3D model of a stream up to `final_endpoint`.
+
+  Returns:
+  - (inp, features, saver): the input placeholder, the features of
+    `final_endpoint` and a saver for the pre-trained variables.
+  """
+
+  if final_endpoint not in [name for name, _, _ in _ENDPOINTS]:
+    raise ValueError('Unknown backbone endpoint %s' % final_endpoint)
+
+  dims = 3 if stream_name == 'RGB' else 2
+  input_shape = (batch_size, num_frames, image_size, image_size, dims)
+  inp = tf.placeholder(tf.float32, shape=input_shape, name=stream_name.lower() + '_input')
 
   with tf.variable_scope(stream_name):
-    model = i3d.InceptionI3d(spatial_squeeze=True, final_endpoint='Mixed_5c')
+    model = i3d.InceptionI3d(spatial_squeeze=True, final_endpoint=final_endpoint,
+                             fold_batch_norm=fold_batch_norm)
     # No training here. Don't backpropagate the main model, and no dropout.
-    mixed_5c, _ = model(inp, is_training=False, dropout_keep_prob=1.0)
+    features, _ = model(inp, is_training=False, dropout_keep_prob=1.0)
 
   var_map = {}
   for var in tf.global_variables():
-    if var.name.split('/')[0] == stream_name:
+    if var.name.startswith(stream_name + '/' + model.module_name + '/'):
       var_map[var.name.replace(':0', '')] = var
 
   saver = tf.train.Saver(var_list=var_map, reshape=True)
+  return (inp, features, saver)
+
+
+def _build_head(stream_name, features, is_training, summaries=True):
+  """
+  Builds the trainable logits layer of a stream on top of backbone features.
+  The features are average pooled over the whole frame and 2 frames at a
+  time, whatever the endpoint, frame count and image size they come from.
+
+  Returns:
+  - (logits, custom_vars): the logits of the stream and a dictionary
+    with the trainable variables of the head, keyed by name. They are
+    also added to the `HEAD_VARIABLES` collection.
+  """
+
+  existing_vars = set(tf.global_variables())
 
+  frames, height, width = features.shape.as_list()[1:4]
   with tf.variable_scope(stream_name):
-    net = tf.nn.avg_pool3d(mixed_5c, ksize=[1, 2, 7, 7, 1],
+    net = tf.nn.avg_pool3d(features, ksize=[1, min(frames, 2), height, width, 1],
                            strides=[1, 1, 1, 1, 1], padding=snt.VALID)
     logit_fn = i3d.Unit3D(output_channels=NUM_CLASSES,
                           kernel_shape=[1, 1, 1],
@@ -56,32 +116,31 @@ def _build_stream(stream_name, is_training):
 
   custom_vars = {}
   for var in tf.global_variables():
-    name = var.name.replace(':0', '')
-    if var.name.split('/')[0] == stream_name and name not in var_map.keys():
+    if var not in existing_vars:
+      name = var.name.replace(':0', '')
       custom_vars[name] = var
-      with tf.name_scope(name):
-        _variable_summaries(var)
+      tf.add_to_collection(HEAD_VARIABLES, var)
+      if summaries:
+        with tf.name_scope(name):
+          _variable_summaries(var)
 
-  return (inp, logits, saver, custom_vars)
+  return (logits, custom_vars)
 
 
-def build_graph(beta):
-  is_training = tf.placeholder(tf.bool, name='is_training')
-  y = tf.placeholder(tf.int32, (_BATCH_SIZE, ))
+def _build_stream(stream_name, is_training, batch_size, **backbone_args):
+  inp, features, saver = _build_backbone(stream_name, batch_size, **backbone_args)
+  logits, custom_vars = _build_head(stream_name, features, is_training)
+  return (inp, logits, saver, custom_vars)
 
-  # Compute streams for RGB and Flow
-  rgb_stream = _build_stream('RGB', is_training)
-  flow_stream = _build_stream('Flow', is_training)
-  rgb_input, rgb_logits, rgb_saver, rgb_vars = rgb_stream
-  flow_input, flow_logits, flow_saver, flow_vars = flow_stream
 
+def _build_training_ops(beta, y, rgb_logits, flow_logits):
   # Combine streams
   logits = rgb_logits + flow_logits
 
   # Compute loss using Softmax from logits
   with tf.name_scope('loss'):
     loss = tf.nn.sparse_softmax_cross_entropy_with_logits(labels=y, logits=logits)
-    tf.summary.scalar('loss_no_reg', tf.squeeze(loss))
+    tf.summary.scalar('loss_no_reg', tf.reduce_mean(loss))
     reg_losses = tf.get_collection(tf.GraphKeys.REGULARIZATION_LOSSES)
     loss = tf.reduce_mean(loss + beta * sum(reg_losses))
     tf.summary.scalar('loss_reg', tf.squeeze(loss))
@@ -89,8 +148,59 @@ def build_graph(beta):
   # Use optimizer to compute gradients
   learning_rate = tf.placeholder(tf.float32, shape=None, name='learning_rate')
   optimizer = tf.train.AdamOptimizer(learning_rate=learning_rate)
-  grads_and_vars = optimizer.compute_gradients(loss)
   loss_minimize = optimizer.minimize(loss)
+  tf.add_to_collection(OPTIMIZER, optimizer)
+
+  return (learning_rate, logits, loss, loss_minimize)
+
+
+def build_gradient_ops(loss):
+  """
+  Builds ops to train the heads of a training graph with gradients
+  computed elsewhere, e.g. averaged over several processes (see
+  `parallel_training.py`). The update uses the optimizer of the training
+  graph, and so its slot variables and learning rate placeholder.
+
+  Returns:
+  - (gradients, gradient_inputs, apply_gradients): the gradients of
+    `loss` with respect to the `HEAD_VARIABLES`, placeholders of the same
+    shapes, and an Adam update of the heads with the fed gradients.
+  """
+
+  optimizer, = tf.get_collection(OPTIMIZER)
+  head_vars = tf.get_collection(HEAD_VARIABLES)
+  gradients = tf.gradients(loss, head_vars)
+  gradient_inputs = [tf.placeholder(var.dtype.base_dtype, var.shape) for var in head_vars]
+  apply_gradients = optimizer.apply_gradients(list(zip(gradient_inputs, head_vars)))
+  return (gradients, gradient_inputs, apply_gradients)
+
+
+def build_graph(beta, batch_size=None, final_endpoint=FINAL_ENDPOINT,
+                num_frames=NUM_FRAMES, image_size=IMAGE_SIZE):
+  """
+  Builds the two-stream I3D graph. Inputs have a leading batch dimension
+  of `batch_size`; when it is `None`, batches of any size can be fed.
+
+  The backbone runs up to `final_endpoint` on videos of `num_frames`
+  frames of `image_size` x `image_size` pixels. Truncating the backbone
+  (e.g. at `Mixed_4f`) or feeding smaller videos makes the model several
+  times cheaper, at some cost in accuracy. The head of each configuration
+  has different variable shapes, so it needs its own training checkpoint.
+  """
+
+  is_training = tf.placeholder(tf.bool, name='is_training')
+  y = tf.placeholder(tf.int32, (batch_size, ))
+
+  # Compute streams for RGB and Flow
+  backbone_args = dict(final_endpoint=final_endpoint, num_frames=num_frames,
+                       image_size=image_size)
+  rgb_stream = _build_stream('RGB', is_training, batch_size, **backbone_args)
+  flow_stream = _build_stream('Flow', is_training, batch_size, **backbone_args)
+  rgb_input, rgb_logits, rgb_saver, rgb_vars = rgb_stream
+  flow_input, flow_logits, flow_saver, flow_vars = flow_stream
+
+  learning_rate, logits, loss, loss_minimize = _build_training_ops(
+    beta, y, rgb_logits, flow_logits)
 
   training_saver_vars = {**rgb_vars, **flow_vars}
   training_saver = tf.train.Saver(var_list=training_saver_vars, reshape=True)
@@ -100,3 +210,128 @@ def build_graph(beta):
   savers = (rgb_saver, flow_saver, training_saver)
   summaries = tf.summary.merge_all()
   return (inputs, outputs, savers, summaries)
+
+
+def feature_shape(num_frames=NUM_FRAMES, image_size=IMAGE_SIZE, endpoint=FINAL_ENDPOINT):
+  """
+  Returns the shape (frames, height, width, channels) of the features of
+  a single video at `endpoint` of the backbone.
+  """
+
+  # All strided layers use SAME padding, so each stride rounds up
+  frames, size = num_frames, image_size
+  for name, (temporal_stride, spatial_stride), channels in _ENDPOINTS:
+    frames = int(np.ceil(frames / temporal_stride))
+    size = int(np.ceil(size / spatial_stride))
+    if name == endpoint:
+      return (frames, size, size, channels)
+
+  raise ValueError('Unknown backbone endpoint %s' % endpoint)
+
+
+def config_name(final_endpoint=FINAL_ENDPOINT, num_frames=NUM_FRAMES, image_size=IMAGE_SIZE):
+  """
+  Returns a suffix like '_Mixed_4f_64x160' which tells apart the training
+  checkpoints of different model configurations. It is empty for the
+  default configuration, so existing checkpoints keep their paths.
+  """
+
+  if (final_endpoint, num_frames, image_size) == (FINAL_ENDPOINT, NUM_FRAMES, IMAGE_SIZE):
+    return ''
+  return '_%s_%dx%d' % (final_endpoint, num_frames, image_size)
+
+
+def build_feature_graph(batch_size=None, final_endpoint=FINAL_ENDPOINT,
+                        num_frames=NUM_FRAMES, image_size=IMAGE_SIZE):
+  """
+  Builds the frozen, pre-trained part of both streams, which maps
+  videos to the features of `final_endpoint`. These features do not
+  change during training, so they can be computed once per video and
+  then fed to the graph of `build_head_graph`.
+
+  Returns:
+  - (inputs, features, savers) where inputs are the (rgb_input,
+    flow_input) placeholders, features are the corresponding
+    (rgb_features, flow_features) and savers are the (rgb_saver,
+    flow_saver) for the pre-trained checkpoints.
+  """
+
+  backbone_args = dict(final_endpoint=final_endpoint, num_frames=num_frames,
+                       image_size=image_size)
+  rgb_input, rgb_features, rgb_saver = _build_backbone('RGB', batch_size, **backbone_args)
+  flow_input, flow_features, flow_saver = _build_backbone('Flow', batch_size, **backbone_args)
+
+  inputs = (rgb_input, flow_input)
+  features = (rgb_features, flow_features)
+  savers = (rgb_saver, flow_saver)
+  return (inputs, features, savers)
+
+
+def build_head_graph(beta, batch_size=None, final_endpoint=FINAL_ENDPOINT,
+                     num_frames=NUM_FRAMES, image_size=IMAGE_SIZE):
+  """
+  Builds the trainable part of both streams on top of the features of
+  `final_endpoint` (see `build_feature_graph`). Variables have the same names
+  as in `build_graph`, so both graphs share the training checkpoint.
+
+  Returns:
+  - (inputs, outputs, training_saver, summaries) like `build_graph`,
+    except that the RGB and Flow inputs are placeholders for features.
+  """
+
+  is_training = tf.placeholder(tf.bool, name='is_training')
+  y = tf.placeholder(tf.int32, (batch_size, ))
+
+  shape = (batch_size, ) + feature_shape(num_frames, image_size, final_endpoint)
+  rgb_input = tf.placeholder(tf.float32, shape=shape)
+  flow_input = tf.placeholder(tf.float32, shape=shape)
+  rgb_logits, rgb_vars = _build_head('RGB', rgb_input, is_training)
+  flow_logits, flow_vars = _build_head('Flow', flow_input, is_training)
+
+  learning_rate, logits, loss, loss_minimize = _build_training_ops(
+    beta, y, rgb_logits, flow_logits)
+
+  training_saver_vars = {**rgb_vars, **flow_vars}
+  training_saver = tf.train.Saver(var_list=training_saver_vars, reshape=True)
+
+  inputs = (learning_rate, rgb_input, flow_input, is_training, y)
+  outputs = (logits, loss, loss_minimize)
+  summaries = tf.summary.merge_all()
+  return (inputs, outputs, training_saver, summaries)
+
+
+def build_inference_graph(batch_size=None, fold_batch_norm=False, final_endpoint=FINAL_ENDPOINT,
+                          num_frames=NUM_FRAMES, image_size=IMAGE_SIZE):
+  """
+  Builds the two-stream model for inference only: there are no labels,
+  loss, optimizer or summary ops, and batch norm always uses the
+  moving averages of the pre-trained model. The inputs are named
+  `rgb_input` and `flow_input`, and the combined logits `logits`.
+
+  With `fold_batch_norm`, the graph has no batch norm ops; instead, the
+  convolutions have a bias into which batch norm must be folded (see
+  `export_graph.py`). The graph then cannot restore the checkpoints.
+
+  See `build_graph` for `final_endpoint`, `num_frames` and `image_size`.
+
+  Returns:
+  - (inputs, logits, savers) where inputs are the (rgb_input, flow_input)
+    placeholders, logits are the combined logits of both streams and
+    savers are the (rgb_saver, flow_saver, training_saver).
+  """
+
+  backbone_args = dict(fold_batch_norm=fold_batch_norm, final_endpoint=final_endpoint,
+                       num_frames=num_frames, image_size=image_size)
+  rgb_input, rgb_features, rgb_saver = _build_backbone('RGB', batch_size, **backbone_args)
+  flow_input, flow_features, flow_saver = _build_backbone('Flow', batch_size, **backbone_args)
+
+  rgb_logits, rgb_vars = _build_head('RGB', rgb_features, False, summaries=False)
+  flow_logits, flow_vars = _build_head('Flow', flow_features, False, summaries=False)
+  logits = tf.add(rgb_logits, flow_logits, name='logits')
+
+  training_saver_vars = {**rgb_vars, **flow_vars}
+  training_saver = tf.train.Saver(var_list=training_saver_vars, reshape=True)
+
+  inputs = (rgb_input, flow_input)
+  savers = (rgb_saver, flow_saver, training_saver)
+  return (inputs, logits, savers)
@@ -0,0 +1,166 @@
+"""
+Loads the trained two-stream model once and classifies videos with it.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+
+import numpy as np
+import tensorflow as tf
+
+from build_graph import build_inference_graph, config_name, FINAL_ENDPOINT, NUM_FRAMES, IMAGE_SIZE
+from build_graph import CHECKPOINT_PATHS
+from process_video import rgb_flow_data, rgb_to_float, iter_windows, video_fps
+
+
+_LABEL_MAP_PATH = 'data/exercises_label_map.txt'
+_FROZEN_MODEL_PATH = 'data/frozen/model.pb'
+
+
+def softmax(logits):
+  """Numerically stable softmax over the last axis of `logits`."""
+
+  exp = np.exp(logits - logits.max(axis=-1, keepdims=True))
+  return exp / exp.sum(axis=-1, keepdims=True)
+
+
+class Classifier(object):
+  """
+  The inference-only graph of the two-stream model, with the pre-trained
+  and trained checkpoints restored into a session which stays open
+  until `close` is called. `final_endpoint`, `num_frames` and
+  `image_size` select a model configuration of `build_graph`, and
+  `sampling` and `frame_step` must match the pre-processing the model
+  was trained with (see `process_video.rgb_data`).
+
+  Example:
+    classifier = Classifier()
+    label, scores = classifier.classify('videos/push-up_correct_1234.mov')
+  """
+
+  def __init__(self, checkpoint_paths=CHECKPOINT_PATHS, label_map_path=_LABEL_MAP_PATH,
+               final_endpoint=FINAL_ENDPOINT, num_frames=NUM_FRAMES, image_size=IMAGE_SIZE,
+               sampling='center', frame_step=2):
+    self.classes = [x.strip() for x in open(label_map_path)]
+    self.num_frames = num_frames
+    self.image_size = image_size
+    self.sampling = sampling
+    self.frame_step = frame_step
+
+    config = dict(final_endpoint=final_endpoint, num_frames=num_frames, image_size=image_size)
+    self._graph = tf.Graph()
+    with self._graph.as_default():
+      inputs, self._logits, savers = build_inference_graph(batch_size=None, **config)
+      self._rgb_input, self._flow_input = inputs
+      rgb_saver, flow_saver, training_saver = savers
+
+    self._sess = tf.Session(graph=self._graph)
+    rgb_saver.restore(self._sess, checkpoint_paths['rgb_imagenet'])
+    flow_saver.restore(self._sess, checkpoint_paths['flow_imagenet'])
+    training_saver.restore(self._sess, checkpoint_paths['training'].format(config_name(**config)))
+
+  def predict(self, rgb, flow):
+    """
+    Returns the logits of shape (batch_size, num_classes) for a batch of
+    pre-processed videos (see `process_video.rgb_flow_data`). RGB may be
+    uint8 or float32.
+    """
+
+    feed_dict = {self._rgb_input: rgb_to_float(rgb), self._flow_input: flow}
+    return self._sess.run(self._logits, feed_dict=feed_dict)
+
+  def classify(self, video_file):
+    """
+    Classifies a single video file.
+
+    Returns:
+    - (label, scores): the predicted class label, and a dictionary of
+      class label -> probability.
+    """
+
+    rgb, flow = rgb_flow_data(video_file, self.image_size, nframes=self.num_frames,
+                              sampling=self.sampling, frame_step=self.frame_step,
+                              as_uint8=True)
+    probs = softmax(self.predict(rgb, flow))[0]
+    return self.classes[probs.argmax()], dict(zip(self.classes, probs.tolist()))
+
+  def classify_windows(self, video_file, stride=None, batch_size=4):
+    """
+    Classifies a video of any length by sliding a window of `num_frames`
+    frames over it, `stride` frames at a time (default: half a window).
+    With 'stride' sampling, windows are made of every `frame_step`-th
+    frame, and `stride` counts these frames only. Windows are scored in
+    batches of `batch_size`, so memory use does not grow with the length
+    of the video. The logits of all windows are averaged.
+
+    Returns:
+    - (label, scores, timeline): the predicted class label, a dictionary
+      of class label -> probability, and a list with the `start` and
+      `end` time (in seconds), `label` and `scores` of every window.
+    """
+
+    fps = video_fps(video_file) or 1.0
+    stride = stride or self.num_frames // 2
+    frame_step = self.frame_step if self.sampling == 'stride' else 1
+    windows, logits = [], []
+
+    def _predict(batch):
+      rgb = np.concatenate([rgb for _, _, rgb, _ in batch], axis=0)
+      flow = np.concatenate([flow for _, _, _, flow in batch], axis=0)
+      logits.extend(self.predict(rgb, flow))
+      windows.extend((first, last) for first, last, _, _ in batch)
+
+    batch = []
+    for window in iter_windows(video_file, self.image_size, self.num_frames, stride,
+                               frame_step=frame_step):
+      batch.append(window)
+      if len(batch) == batch_size:
+        _predict(batch)
+        batch = []
+    if batch:
+      _predict(batch)
+
+    logits = np.array(logits)
+    timeline = []
+    for (first, last), probs in zip(windows, softmax(logits)):
+      timeline.append({
+        'start': first / fps,
+        'end': last / fps,
+        'label': self.classes[probs.argmax()],
+        'scores': dict(zip(self.classes, probs.tolist()))
+      })
+
+    probs = softmax(logits.mean(axis=0))
+    return self.classes[probs.argmax()], dict(zip(self.classes, probs.tolist())), timeline
+
+  def close(self):
+    self._sess.close()
+
+
+class FrozenClassifier(Classifier):
+  """
+  Same as `Classifier`, but loads a frozen inference graph written by
+  `export_graph.py` instead of building the model and restoring the
+  checkpoints, which makes start-up faster and uses less memory. The
+  frame count and image size are those the graph was exported with.
+  """
+
+  def __init__(self, model_path=_FROZEN_MODEL_PATH, label_map_path=_LABEL_MAP_PATH,
+               sampling='center', frame_step=2):
+    self.classes = [x.strip() for x in open(label_map_path)]
+    self.sampling = sampling
+    self.frame_step = frame_step
+
+    graph_def = tf.GraphDef()
+    with tf.gfile.GFile(model_path, 'rb') as f:
+      graph_def.ParseFromString(f.read())
+
+    self._graph = tf.Graph()
+    with self._graph.as_default():
+      tf.import_graph_def(graph_def, name='')
+    self._rgb_input = self._graph.get_tensor_by_name('rgb_input:0')
+    self._flow_input = self._graph.get_tensor_by_name('flow_input:0')
+    self._logits = self._graph.get_tensor_by_name('logits:0')
+    self.num_frames, self.image_size = self._rgb_input.shape.as_list()[1:3]
+
+    self._sess = tf.Session(graph=self._graph)
@@ -0,0 +1,172 @@
+#!/opt/anaconda3/bin/python
+
+"""
+Batched evaluation of the two-stream model. Several videos are scored
+per `sess.run`, pre-processing is prefetched in the background, and the
+results include per-class accuracy and a confusion matrix.
+
+Running this file evaluates the trained model on a directory of videos
+using the inference-only graph.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+import argparse
+import numpy as np
+import tensorflow as tf
+
+from build_graph import build_inference_graph, config_name, NUM_CLASSES
+from build_graph import FINAL_ENDPOINT, NUM_FRAMES, IMAGE_SIZE, CHECKPOINT_PATHS
+from load_dataset import DatasetIndex
+from prefetch import Prefetcher
+from process_video import SAMPLINGS, rgb_to_float
+from video_cache import cached_rgb_flow_data
+
+
+_VIDEO_DIR = 'videos'
+_LABEL_MAP_PATH = 'data/exercises_label_map.txt'
+_CACHE_DIR = 'data/cache'
+
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
+
+
+def _metrics(y_true, y_pred, num_classes):
+  confusion = np.zeros((num_classes, num_classes), dtype=np.int64)
+  np.add.at(confusion, (y_true, y_pred), 1)
+  return _confusion_metrics(confusion)
+
+
+def _confusion_metrics(confusion):
+  num_samples = confusion.sum()
+  num_correct = np.trace(confusion)
+  per_class_total = confusion.sum(axis=1)
+  with np.errstate(divide='ignore', invalid='ignore'):
+    per_class_acc = np.diag(confusion) / per_class_total
+
+  return {
+    'num_samples': int(num_samples),
+    'num_correct': int(num_correct),
+    'accuracy': float(num_correct) / max(num_samples, 1),
+    'per_class_accuracy': per_class_acc,
+    'confusion_matrix': confusion
+  }
+
+
+def evaluate(sess, inputs, logits, dsets, preprocess_fn, batch_size=8,
+             prefetch_depth=2, feed_dict=None, num_classes=NUM_CLASSES):
+  """
+  Evaluates the model on one or more datasets in a single pass.
+
+  Parameters:
+  - sess: a session in which the model variables are initialized
+  - inputs: the (rgb_input, flow_input) placeholders of the model
+  - logits: the logits of the model, of shape (batch_size, num_classes)
+  - dsets: a dictionary of name -> list of (x_video, y_class) samples
+  - preprocess_fn: maps a video path to the (rgb, flow) values fed to `inputs`,
+    where uint8 RGB is converted with `process_video.rgb_to_float` when fed
+  - batch_size: number of videos scored per `sess.run`
+  - prefetch_depth: number of batches pre-processed ahead of `sess.run`
+  - feed_dict: additional values to feed, e.g. `{is_training: 0}`
+
+  Returns:
+  - A dictionary of name -> metrics, where the metrics are a dictionary
+    with `num_samples`, `num_correct`, `accuracy`, `per_class_accuracy`
+    and `confusion_matrix` (rows are true classes, columns predictions).
+  """
+
+  # All datasets go through one pipeline, so it never drains in between
+  names = list(dsets.keys())
+  samples = [(name, x, y) for name in names for x, y in dsets[name]]
+  batches = [samples[i:i + batch_size] for i in range(0, len(samples), batch_size)]
+
+  def _preprocess_batch(batch):
+    data = [preprocess_fn(x_video) for _, x_video, _ in batch]
+    rgb = np.concatenate([rgb for rgb, _ in data], axis=0)
+    flow = np.concatenate([flow for _, flow in data], axis=0)
+    return rgb, flow
+
+  predictions = []
+  pipeline = Prefetcher(batches, _preprocess_batch, depth=prefetch_depth)
+  for _, (rgb, flow) in pipeline:
+    batch_feed_dict = dict(feed_dict or {})
+    batch_feed_dict.update(zip(inputs, (rgb_to_float(rgb), flow)))
+    logits_np = sess.run(logits, feed_dict=batch_feed_dict)
+    predictions.extend(logits_np.argmax(axis=1))
+  tf.logging.info(pipeline.report('Evaluation'))
+
+  results = {}
+  for name in names:
+    idx = [i for i, sample in enumerate(samples) if sample[0] == name]
+    y_true = np.array([samples[i][2] for i in idx], dtype=np.int64)
+    y_pred = np.array([predictions[i] for i in idx], dtype=np.int64)
+    results[name] = _metrics(y_true, y_pred, num_classes)
+
+  return results
+
+
+def merge_metrics(metrics_list):
+  """Combines the metrics of disjoint parts of a dataset, e.g. evaluated by several processes."""
+
+  return _confusion_metrics(sum(metrics['confusion_matrix'] for metrics in metrics_list))
+
+
+def format_metrics(msg, metrics, classes=None):
+  """Returns a printable report of the metrics of one dataset."""
+
+  num_classes = metrics['confusion_matrix'].shape[0]
+  classes = classes or [str(i) for i in range(num_classes)]
+  width = max(len(c) for c in classes)
+
+  lines = ['%s: %d / %d correct (%.2f%%)' % (
+    msg, metrics['num_correct'], metrics['num_samples'], 100 * metrics['accuracy']
+  )]
+  for c, acc, row in zip(classes, metrics['per_class_accuracy'], metrics['confusion_matrix']):
+    acc = 'n/a' if np.isnan(acc) else '%.2f%%' % (100 * acc)
+    counts = ' '.join('%4d' % n for n in row)
+    lines.append('  %s  %s  %7s' % (c.ljust(width), counts, acc))
+  return '\n'.join(lines)
+
+
+def _parse_args():
+  parser = argparse.ArgumentParser(description='Evaluate the trained model on a set of videos.')
+  parser.add_argument('--video-dir', default=_VIDEO_DIR)
+  parser.add_argument('--label-map', default=_LABEL_MAP_PATH)
+  parser.add_argument('--index-path', default=None,
+                      help='dataset index (default: in --video-dir, if it is writable)')
+  parser.add_argument('--cache-dir', default=_CACHE_DIR)
+  parser.add_argument('--batch-size', type=int, default=8)
+  parser.add_argument('--prefetch-depth', type=int, default=2)
+  parser.add_argument('--final-endpoint', default=FINAL_ENDPOINT)
+  parser.add_argument('--num-frames', type=int, default=NUM_FRAMES)
+  parser.add_argument('--image-size', type=int, default=IMAGE_SIZE)
+  parser.add_argument('--sampling', choices=SAMPLINGS, default='center')
+  parser.add_argument('--frame-step', type=int, default=2)
+  return parser.parse_args()
+
+
+if __name__ == '__main__':
+  args = _parse_args()
+
+  config = dict(final_endpoint=args.final_endpoint, num_frames=args.num_frames,
+                image_size=args.image_size)
+  inputs, logits, savers = build_inference_graph(batch_size=None, **config)
+  rgb_saver, flow_saver, training_saver = savers
+
+  X, y = DatasetIndex.open(args.video_dir, args.label_map, index_path=args.index_path).videos()
+  classes = [x.strip() for x in open(args.label_map)]
+
+  def _preprocess(x_video):
+    return cached_rgb_flow_data(x_video, args.image_size, nframes=args.num_frames,
+                                cache_dir=args.cache_dir, sampling=args.sampling,
+                                frame_step=args.frame_step)
+
+  with tf.Session() as sess:
+    rgb_saver.restore(sess, CHECKPOINT_PATHS['rgb_imagenet'])
+    flow_saver.restore(sess, CHECKPOINT_PATHS['flow_imagenet'])
+    training_saver.restore(sess, CHECKPOINT_PATHS['training'].format(config_name(**config)))
+
+    results = evaluate(sess, inputs, logits, {'Dataset': list(zip(X, y))}, _preprocess,
+                       batch_size=args.batch_size, prefetch_depth=args.prefetch_depth)
+    print(format_metrics('Dataset', results['Dataset'], classes=classes))
@@ -0,0 +1,133 @@
+#!/opt/anaconda3/bin/python
+
+"""
+Exports the trained two-stream model as a frozen inference graph. The
+batch norm of every `Unit3D` is folded into its convolution, variables
+are turned into constants, constant expressions are folded, and all ops
+which are not needed to compute the logits are stripped.
+
+The exported graph is loaded with `classifier.FrozenClassifier`.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+import argparse
+import numpy as np
+import tensorflow as tf
+from tensorflow.tools.graph_transforms import TransformGraph
+
+from build_graph import build_inference_graph, config_name, FINAL_ENDPOINT, NUM_FRAMES, IMAGE_SIZE
+from build_graph import CHECKPOINT_PATHS
+
+
+_EXPORT_PATH = 'data/frozen/model.pb'
+
+# Epsilon of snt.BatchNorm
+_BATCH_NORM_EPS = 1e-3
+
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
+
+
+def _restore_values(checkpoint_paths, config):
+  """Restores all checkpoints and returns the value of every variable by name."""
+
+  with tf.Graph().as_default():
+    _, _, savers = build_inference_graph(batch_size=None, **config)
+    rgb_saver, flow_saver, training_saver = savers
+
+    with tf.Session() as sess:
+      rgb_saver.restore(sess, checkpoint_paths['rgb_imagenet'])
+      flow_saver.restore(sess, checkpoint_paths['flow_imagenet'])
+      training_saver.restore(sess, checkpoint_paths['training'].format(config_name(**config)))
+
+      variables = tf.global_variables()
+      values = sess.run(variables)
+      return {var.op.name: value for var, value in zip(variables, values)}
+
+
+def _fold_batch_norm(values):
+  """
+  Folds each batch norm into the preceding convolution:
+    w' = w * gamma / sqrt(var + eps)
+    b' = beta - mean * gamma / sqrt(var + eps)
+
+  Returns:
+  - The variable values of a graph built with `fold_batch_norm=True`.
+  """
+
+  suffix = 'batch_norm/moving_mean'
+  folded = {name: value for name, value in values.items() if '/batch_norm/' not in name}
+
+  # The folded weights replace the copies, whatever the order of the variables
+  for name, value in values.items():
+    if not name.endswith(suffix):
+      continue
+
+    prefix = name[:-len(suffix)]
+    mean = value.reshape(-1)
+    variance = values[prefix + 'batch_norm/moving_variance'].reshape(-1)
+    gamma = values.get(prefix + 'batch_norm/gamma', np.ones_like(mean)).reshape(-1)
+    beta = values.get(prefix + 'batch_norm/beta', np.zeros_like(mean)).reshape(-1)
+
+    scale = gamma / np.sqrt(variance + _BATCH_NORM_EPS)
+    weights = values[prefix + 'conv_3d/w']
+    folded[prefix + 'conv_3d/w'] = (weights * scale).astype(weights.dtype)
+    folded[prefix + 'conv_3d/b'] = (beta - mean * scale).astype(weights.dtype)
+
+  return folded
+
+
+def export_frozen_graph(export_path=_EXPORT_PATH, checkpoint_paths=CHECKPOINT_PATHS,
+                        final_endpoint=FINAL_ENDPOINT, num_frames=NUM_FRAMES, image_size=IMAGE_SIZE):
+  """
+  Writes the frozen inference graph of the trained model to `export_path`.
+  Its inputs are `rgb_input:0` and `flow_input:0`, and its output is
+  `logits:0`, all with a variable batch size. `final_endpoint`,
+  `num_frames` and `image_size` select a model configuration of `build_graph`.
+  """
+
+  config = dict(final_endpoint=final_endpoint, num_frames=num_frames, image_size=image_size)
+  values = _fold_batch_norm(_restore_values(checkpoint_paths, config))
+
+  with tf.Graph().as_default() as graph:
+    build_inference_graph(batch_size=None, fold_batch_norm=True, **config)
+
+    with tf.Session() as sess:
+      for var in tf.global_variables():
+        var.load(values[var.op.name], sess)
+
+      graph_def = tf.graph_util.convert_variables_to_constants(
+        sess, graph.as_graph_def(), ['logits'])
+
+  graph_def = tf.graph_util.remove_training_nodes(graph_def, protected_nodes=['logits'])
+  graph_def = TransformGraph(graph_def, ['rgb_input', 'flow_input'], ['logits'], [
+    'strip_unused_nodes',
+    'fold_constants(ignore_errors=true)',
+    'sort_by_execution_order'
+  ])
+
+  export_dir = os.path.dirname(export_path)
+  if export_dir and not os.path.exists(export_dir):
+    os.makedirs(export_dir)
+  with tf.gfile.GFile(export_path, 'wb') as f:
+    f.write(graph_def.SerializeToString())
+
+  return export_path
+
+
+def _parse_args():
+  parser = argparse.ArgumentParser(description='Export a frozen inference graph.')
+  parser.add_argument('--output', default=_EXPORT_PATH)
+  parser.add_argument('--final-endpoint', default=FINAL_ENDPOINT)
+  parser.add_argument('--num-frames', type=int, default=NUM_FRAMES)
+  parser.add_argument('--image-size', type=int, default=IMAGE_SIZE)
+  return parser.parse_args()
+
+
+if __name__ == '__main__':
+  args = _parse_args()
+  export_path = export_frozen_graph(args.output, final_endpoint=args.final_endpoint,
+                                    num_frames=args.num_frames, image_size=args.image_size)
+  print('Frozen graph written to %s' % export_path)
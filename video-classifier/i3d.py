@@ -39,8 +39,14 @@ class Unit3D(snt.AbstractModule):
                use_batch_norm=True,
                use_bias=False,
                regularizers=None,
+               fold_batch_norm=False,
                name='unit_3d'):
-    """Initializes Unit3D module."""
+    """Initializes Unit3D module.
+
+    If `fold_batch_norm` is True, batch norm is expected to be folded into
+    the weights and bias of the convolution, so the convolution has a bias
+    and no batch norm is applied.
+    """
     super(Unit3D, self).__init__(name=name)
     self._output_channels = output_channels
     self._kernel_shape = kernel_shape
@@ -49,6 +55,9 @@ class Unit3D(snt.AbstractModule):
     self._activation_fn = activation_fn
     self._use_bias = use_bias
     self._regularizers = regularizers
+    if fold_batch_norm and use_batch_norm:
+      self._use_batch_norm = False
+      self._use_bias = True
 
   def _build(self, inputs, is_training):
     """Connects the module to inputs.
@@ -116,7 +125,8 @@ class InceptionI3d(snt.AbstractModule):
   )
 
   def __init__(self, num_classes=400, spatial_squeeze=True,
-               final_endpoint='Logits', name='inception_i3d'):
+               final_endpoint='Logits', fold_batch_norm=False,
+               name='inception_i3d'):
     """Initializes I3D model instance.
 
     Args:
@@ -130,6 +140,8 @@ class InceptionI3d(snt.AbstractModule):
           at endpoints up to `final_endpoint` will also be returned, in a
           dictionary. `final_endpoint` must be one of
           InceptionI3d.VALID_ENDPOINTS (default 'Logits').
+      fold_batch_norm: Whether batch norm is folded into the convolutions of
+          all Unit3D modules (default False). See `Unit3D`.
       name: A string (optional). The name of this module.
 
     Raises:
@@ -143,6 +155,10 @@ class InceptionI3d(snt.AbstractModule):
     self._num_classes = num_classes
     self._spatial_squeeze = spatial_squeeze
     self._final_endpoint = final_endpoint
+    self._fold_batch_norm = fold_batch_norm
+
+  def _unit_3d(self, **kwargs):
+    return Unit3D(fold_batch_norm=self._fold_batch_norm, **kwargs)
 
   def _build(self, inputs, is_training, dropout_keep_prob=1.0):
     """Connects the model to inputs.
@@ -169,8 +185,9 @@ class InceptionI3d(snt.AbstractModule):
     net = inputs
     end_points = {}
     end_point = 'Conv3d_1a_7x7'
-    net = Unit3D(output_channels=64, kernel_shape=[7, 7, 7],
-                 stride=[2, 2, 2], name=end_point)(net, is_training=is_training)
+    net = self._unit_3d(output_channels=64, kernel_shape=[7, 7, 7],
+                        stride=[2, 2, 2],
+                        name=end_point)(net, is_training=is_training)
     end_points[end_point] = net
     if self._final_endpoint == end_point: return net, end_points
     end_point = 'MaxPool3d_2a_3x3'
@@ -179,13 +196,13 @@ class InceptionI3d(snt.AbstractModule):
     end_points[end_point] = net
     if self._final_endpoint == end_point: return net, end_points
     end_point = 'Conv3d_2b_1x1'
-    net = Unit3D(output_channels=64, kernel_shape=[1, 1, 1],
-                 name=end_point)(net, is_training=is_training)
+    net = self._unit_3d(output_channels=64, kernel_shape=[1, 1, 1],
+                        name=end_point)(net, is_training=is_training)
     end_points[end_point] = net
     if self._final_endpoint == end_point: return net, end_points
     end_point = 'Conv3d_2c_3x3'
-    net = Unit3D(output_channels=192, kernel_shape=[3, 3, 3],
-                 name=end_point)(net, is_training=is_training)
+    net = self._unit_3d(output_channels=192, kernel_shape=[3, 3, 3],
+                        name=end_point)(net, is_training=is_training)
     end_points[end_point] = net
     if self._final_endpoint == end_point: return net, end_points
     end_point = 'MaxPool3d_3a_3x3'
@@ -197,27 +214,30 @@ class InceptionI3d(snt.AbstractModule):
     end_point = 'Mixed_3b'
     with tf.variable_scope(end_point):
       with tf.variable_scope('Branch_0'):
-        branch_0 = Unit3D(output_channels=64, kernel_shape=[1, 1, 1],
-                          name='Conv3d_0a_1x1')(net, is_training=is_training)
+        branch_0 = self._unit_3d(output_channels=64, kernel_shape=[1, 1, 1],
+                                 name='Conv3d_0a_1x1')(net,
+                                                       is_training=is_training)
       with tf.variable_scope('Branch_1'):
-        branch_1 = Unit3D(output_channels=96, kernel_shape=[1, 1, 1],
-                          name='Conv3d_0a_1x1')(net, is_training=is_training)
-        branch_1 = Unit3D(output_channels=128, kernel_shape=[3, 3, 3],
-                          name='Conv3d_0b_3x3')(branch_1,
-                                                is_training=is_training)
+        branch_1 = self._unit_3d(output_channels=96, kernel_shape=[1, 1, 1],
+                                 name='Conv3d_0a_1x1')(net,
+                                                       is_training=is_training)
+        branch_1 = self._unit_3d(output_channels=128, kernel_shape=[3, 3, 3],
+                                 name='Conv3d_0b_3x3')(branch_1,
+                                                       is_training=is_training)
       with tf.variable_scope('Branch_2'):
-        branch_2 = Unit3D(output_channels=16, kernel_shape=[1, 1, 1],
-                          name='Conv3d_0a_1x1')(net, is_training=is_training)
-        branch_2 = Unit3D(output_channels=32, kernel_shape=[3, 3, 3],
-                          name='Conv3d_0b_3x3')(branch_2,
-                                                is_training=is_training)
+        branch_2 = self._unit_3d(output_channels=16, kernel_shape=[1, 1, 1],
+                                 name='Conv3d_0a_1x1')(net,
+                                                       is_training=is_training)
+        branch_2 = self._unit_3d(output_channels=32, kernel_shape=[3, 3, 3],
+                                 name='Conv3d_0b_3x3')(branch_2,
+                                                       is_training=is_training)
       with tf.variable_scope('Branch_3'):
         branch_3 = tf.nn.max_pool3d(net, ksize=[1, 3, 3, 3, 1],
                                     strides=[1, 1, 1, 1, 1], padding=snt.SAME,
                                     name='MaxPool3d_0a_3x3')
-        branch_3 = Unit3D(output_channels=32, kernel_shape=[1, 1, 1],
-                          name='Conv3d_0b_1x1')(branch_3,
-                                                is_training=is_training)
+        branch_3 = self._unit_3d(output_channels=32, kernel_shape=[1, 1, 1],
+                                 name='Conv3d_0b_1x1')(branch_3,
+                                                       is_training=is_training)
 
       net = tf.concat([branch_0, branch_1, branch_2, branch_3], 4)
     end_points[end_point] = net
@@ -226,27 +246,30 @@ class InceptionI3d(snt.AbstractModule):
     end_point = 'Mixed_3c'
     with tf.variable_scope(end_point):
       with tf.variable_scope('Branch_0'):
-        branch_0 = Unit3D(output_channels=128, kernel_shape=[1, 1, 1],
-                          name='Conv3d_0a_1x1')(net, is_training=is_training)
+        branch_0 = self._unit_3d(output_channels=128, kernel_shape=[1, 1, 1],
+                                 name='Conv3d_0a_1x1')(net,
+                                                       is_training=is_training)
       with tf.variable_scope('Branch_1'):
-        branch_1 = Unit3D(output_channels=128, kernel_shape=[1, 1, 1],
-                          name='Conv3d_0a_1x1')(net, is_training=is_training)
-        branch_1 = Unit3D(output_channels=192, kernel_shape=[3, 3, 3],
-                          name='Conv3d_0b_3x3')(branch_1,
-                                                is_training=is_training)
+        branch_1 = self._unit_3d(output_channels=128, kernel_shape=[1, 1, 1],
+                                 name='Conv3d_0a_1x1')(net,
+                                                       is_training=is_training)
+        branch_1 = self._unit_3d(output_channels=192, kernel_shape=[3, 3, 3],
+                                 name='Conv3d_0b_3x3')(branch_1,
+                                                       is_training=is_training)
       with tf.variable_scope('Branch_2'):
-        branch_2 = Unit3D(output_channels=32, kernel_shape=[1, 1, 1],
-                          name='Conv3d_0a_1x1')(net, is_training=is_training)
-        branch_2 = Unit3D(output_channels=96, kernel_shape=[3, 3, 3],
-                          name='Conv3d_0b_3x3')(branch_2,
-                                                is_training=is_training)
+        branch_2 = self._unit_3d(output_channels=32, kernel_shape=[1, 1, 1],
+                                 name='Conv3d_0a_1x1')(net,
+                                                       is_training=is_training)
+        branch_2 = self._unit_3d(output_channels=96, kernel_shape=[3, 3, 3],
+                                 name='Conv3d_0b_3x3')(branch_2,
+                                                       is_training=is_training)
       with tf.variable_scope('Branch_3'):
         branch_3 = tf.nn.max_pool3d(net, ksize=[1, 3, 3, 3, 1],
                                     strides=[1, 1, 1, 1, 1], padding=snt.SAME,
                                     name='MaxPool3d_0a_3x3')
-        branch_3 = Unit3D(output_channels=64, kernel_shape=[1, 1, 1],
-                          name='Conv3d_0b_1x1')(branch_3,
-                                                is_training=is_training)
+        branch_3 = self._unit_3d(output_channels=64, kernel_shape=[1, 1, 1],
+                                 name='Conv3d_0b_1x1')(branch_3,
+                                                       is_training=is_training)
       net = tf.concat([branch_0, branch_1, branch_2, branch_3], 4)
     end_points[end_point] = net
     if self._final_endpoint == end_point: return net, end_points
@@ -260,27 +283,30 @@ class InceptionI3d(snt.AbstractModule):
     end_point = 'Mixed_4b'
     with tf.variable_scope(end_point):
       with tf.variable_scope('Branch_0'):
-        branch_0 = Unit3D(output_channels=192, kernel_shape=[1, 1, 1],
-                          name='Conv3d_0a_1x1')(net, is_training=is_training)
+        branch_0 = self._unit_3d(output_channels=192, kernel_shape=[1, 1, 1],
+                                 name='Conv3d_0a_1x1')(net,
+                                                       is_training=is_training)
       with tf.variable_scope('Branch_1'):
-        branch_1 = Unit3D(output_channels=96, kernel_shape=[1, 1, 1],
-                          name='Conv3d_0a_1x1')(net, is_training=is_training)
-        branch_1 = Unit3D(output_channels=208, kernel_shape=[3, 3, 3],
-                          name='Conv3d_0b_3x3')(branch_1,
-                                                is_training=is_training)
+        branch_1 = self._unit_3d(output_channels=96, kernel_shape=[1, 1, 1],
+                                 name='Conv3d_0a_1x1')(net,
+                                                       is_training=is_training)
+        branch_1 = self._unit_3d(output_channels=208, kernel_shape=[3, 3, 3],
+                                 name='Conv3d_0b_3x3')(branch_1,
+                                                       is_training=is_training)
       with tf.variable_scope('Branch_2'):
-        branch_2 = Unit3D(output_channels=16, kernel_shape=[1, 1, 1],
-                          name='Conv3d_0a_1x1')(net, is_training=is_training)
-        branch_2 = Unit3D(output_channels=48, kernel_shape=[3, 3, 3],
-                          name='Conv3d_0b_3x3')(branch_2,
-                                                is_training=is_training)
+        branch_2 = self._unit_3d(output_channels=16, kernel_shape=[1, 1, 1],
+                                 name='Conv3d_0a_1x1')(net,
+                                                       is_training=is_training)
+        branch_2 = self._unit_3d(output_channels=48, kernel_shape=[3, 3, 3],
+                                 name='Conv3d_0b_3x3')(branch_2,
+                                                       is_training=is_training)
       with tf.variable_scope('Branch_3'):
         branch_3 = tf.nn.max_pool3d(net, ksize=[1, 3, 3, 3, 1],
                                     strides=[1, 1, 1, 1, 1], padding=snt.SAME,
                                     name='MaxPool3d_0a_3x3')
-        branch_3 = Unit3D(output_channels=64, kernel_shape=[1, 1, 1],
-                          name='Conv3d_0b_1x1')(branch_3,
-                                                is_training=is_training)
+        branch_3 = self._unit_3d(output_channels=64, kernel_shape=[1, 1, 1],
+                                 name='Conv3d_0b_1x1')(branch_3,
+                                                       is_training=is_training)
       net = tf.concat([branch_0, branch_1, branch_2, branch_3], 4)
     end_points[end_point] = net
     if self._final_endpoint == end_point: return net, end_points
@@ -288,27 +314,30 @@ class InceptionI3d(snt.AbstractModule):
     end_point = 'Mixed_4c'
     with tf.variable_scope(end_point):
       with tf.variable_scope('Branch_0'):
-        branch_0 = Unit3D(output_channels=160, kernel_shape=[1, 1, 1],
-                          name='Conv3d_0a_1x1')(net, is_training=is_training)
+        branch_0 = self._unit_3d(output_channels=160, kernel_shape=[1, 1, 1],
+                                 name='Conv3d_0a_1x1')(net,
+                                                       is_training=is_training)
       with tf.variable_scope('Branch_1'):
-        branch_1 = Unit3D(output_channels=112, kernel_shape=[1, 1, 1],
-                          name='Conv3d_0a_1x1')(net, is_training=is_training)
-        branch_1 = Unit3D(output_channels=224, kernel_shape=[3, 3, 3],
-                          name='Conv3d_0b_3x3')(branch_1,
-                                                is_training=is_training)
+        branch_1 = self._unit_3d(output_channels=112, kernel_shape=[1, 1, 1],
+                                 name='Conv3d_0a_1x1')(net,
+                                                       is_training=is_training)
+        branch_1 = self._unit_3d(output_channels=224, kernel_shape=[3, 3, 3],
+                                 name='Conv3d_0b_3x3')(branch_1,
+                                                       is_training=is_training)
       with tf.variable_scope('Branch_2'):
-        branch_2 = Unit3D(output_channels=24, kernel_shape=[1, 1, 1],
-                          name='Conv3d_0a_1x1')(net, is_training=is_training)
-        branch_2 = Unit3D(output_channels=64, kernel_shape=[3, 3, 3],
-                          name='Conv3d_0b_3x3')(branch_2,
-                                                is_training=is_training)
+        branch_2 = self._unit_3d(output_channels=24, kernel_shape=[1, 1, 1],
+                                 name='Conv3d_0a_1x1')(net,
+                                                       is_training=is_training)
+        branch_2 = self._unit_3d(output_channels=64, kernel_shape=[3, 3, 3],
+                                 name='Conv3d_0b_3x3')(branch_2,
+                                                       is_training=is_training)
       with tf.variable_scope('Branch_3'):
         branch_3 = tf.nn.max_pool3d(net, ksize=[1, 3, 3, 3, 1],
                                     strides=[1, 1, 1, 1, 1], padding=snt.SAME,
                                     name='MaxPool3d_0a_3x3')
-        branch_3 = Unit3D(output_channels=64, kernel_shape=[1, 1, 1],
-                          name='Conv3d_0b_1x1')(branch_3,
-                                                is_training=is_training)
+        branch_3 = self._unit_3d(output_channels=64, kernel_shape=[1, 1, 1],
+                                 name='Conv3d_0b_1x1')(branch_3,
+                                                       is_training=is_training)
       net = tf.concat([branch_0, branch_1, branch_2, branch_3], 4)
     end_points[end_point] = net
     if self._final_endpoint == end_point: return net, end_points
@@ -316,27 +345,30 @@ class InceptionI3d(snt.AbstractModule):
     end_point = 'Mixed_4d'
     with tf.variable_scope(end_point):
       with tf.variable_scope('Branch_0'):
-        branch_0 = Unit3D(output_channels=128, kernel_shape=[1, 1, 1],
-                          name='Conv3d_0a_1x1')(net, is_training=is_training)
+        branch_0 = self._unit_3d(output_channels=128, kernel_shape=[1, 1, 1],
+                                 name='Conv3d_0a_1x1')(net,
+                                                       is_training=is_training)
       with tf.variable_scope('Branch_1'):
-        branch_1 = Unit3D(output_channels=128, kernel_shape=[1, 1, 1],
-                          name='Conv3d_0a_1x1')(net, is_training=is_training)
-        branch_1 = Unit3D(output_channels=256, kernel_shape=[3, 3, 3],
-                          name='Conv3d_0b_3x3')(branch_1,
-                                                is_training=is_training)
+        branch_1 = self._unit_3d(output_channels=128, kernel_shape=[1, 1, 1],
+                                 name='Conv3d_0a_1x1')(net,
+                                                       is_training=is_training)
+        branch_1 = self._unit_3d(output_channels=256, kernel_shape=[3, 3, 3],
+                                 name='Conv3d_0b_3x3')(branch_1,
+                                                       is_training=is_training)
       with tf.variable_scope('Branch_2'):
-        branch_2 = Unit3D(output_channels=24, kernel_shape=[1, 1, 1],
-                          name='Conv3d_0a_1x1')(net, is_training=is_training)
-        branch_2 = Unit3D(output_channels=64, kernel_shape=[3, 3, 3],
-                          name='Conv3d_0b_3x3')(branch_2,
-                                                is_training=is_training)
+        branch_2 = self._unit_3d(output_channels=24, kernel_shape=[1, 1, 1],
+                                 name='Conv3d_0a_1x1')(net,
+                                                       is_training=is_training)
+        branch_2 = self._unit_3d(output_channels=64, kernel_shape=[3, 3, 3],
+                                 name='Conv3d_0b_3x3')(branch_2,
+                                                       is_training=is_training)
       with tf.variable_scope('Branch_3'):
         branch_3 = tf.nn.max_pool3d(net, ksize=[1, 3, 3, 3, 1],
                                     strides=[1, 1, 1, 1, 1], padding=snt.SAME,
                                     name='MaxPool3d_0a_3x3')
-        branch_3 = Unit3D(output_channels=64, kernel_shape=[1, 1, 1],
-                          name='Conv3d_0b_1x1')(branch_3,
-                                                is_training=is_training)
+        branch_3 = self._unit_3d(output_channels=64, kernel_shape=[1, 1, 1],
+                                 name='Conv3d_0b_1x1')(branch_3,
+                                                       is_training=is_training)
       net = tf.concat([branch_0, branch_1, branch_2, branch_3], 4)
     end_points[end_point] = net
     if self._final_endpoint == end_point: return net, end_points
@@ -344,27 +376,30 @@ class InceptionI3d(snt.AbstractModule):
     end_point = 'Mixed_4e'
     with tf.variable_scope(end_point):
       with tf.variable_scope('Branch_0'):
-        branch_0 = Unit3D(output_channels=112, kernel_shape=[1, 1, 1],
-                          name='Conv3d_0a_1x1')(net, is_training=is_training)
+        branch_0 = self._unit_3d(output_channels=112, kernel_shape=[1, 1, 1],
+                                 name='Conv3d_0a_1x1')(net,
+                                                       is_training=is_training)
       with tf.variable_scope('Branch_1'):
-        branch_1 = Unit3D(output_channels=144, kernel_shape=[1, 1, 1],
-                          name='Conv3d_0a_1x1')(net, is_training=is_training)
-        branch_1 = Unit3D(output_channels=288, kernel_shape=[3, 3, 3],
-                          name='Conv3d_0b_3x3')(branch_1,
-                                                is_training=is_training)
+        branch_1 = self._unit_3d(output_channels=144, kernel_shape=[1, 1, 1],
+                                 name='Conv3d_0a_1x1')(net,
+                                                       is_training=is_training)
+        branch_1 = self._unit_3d(output_channels=288, kernel_shape=[3, 3, 3],
+                                 name='Conv3d_0b_3x3')(branch_1,
+                                                       is_training=is_training)
       with tf.variable_scope('Branch_2'):
-        branch_2 = Unit3D(output_channels=32, kernel_shape=[1, 1, 1],
-                          name='Conv3d_0a_1x1')(net, is_training=is_training)
-        branch_2 = Unit3D(output_channels=64, kernel_shape=[3, 3, 3],
-                          name='Conv3d_0b_3x3')(branch_2,
-                                                is_training=is_training)
+        branch_2 = self._unit_3d(output_channels=32, kernel_shape=[1, 1, 1],
+                                 name='Conv3d_0a_1x1')(net,
+                                                       is_training=is_training)
+        branch_2 = self._unit_3d(output_channels=64, kernel_shape=[3, 3, 3],
+                                 name='Conv3d_0b_3x3')(branch_2,
+                                                       is_training=is_training)
       with tf.variable_scope('Branch_3'):
         branch_3 = tf.nn.max_pool3d(net, ksize=[1, 3, 3, 3, 1],
                                     strides=[1, 1, 1, 1, 1], padding=snt.SAME,
                                     name='MaxPool3d_0a_3x3')
-        branch_3 = Unit3D(output_channels=64, kernel_shape=[1, 1, 1],
-                          name='Conv3d_0b_1x1')(branch_3,
-                                                is_training=is_training)
+        branch_3 = self._unit_3d(output_channels=64, kernel_shape=[1, 1, 1],
+                                 name='Conv3d_0b_1x1')(branch_3,
+                                                       is_training=is_training)
       net = tf.concat([branch_0, branch_1, branch_2, branch_3], 4)
     end_points[end_point] = net
     if self._final_endpoint == end_point: return net, end_points
@@ -372,27 +407,30 @@ class InceptionI3d(snt.AbstractModule):
     end_point = 'Mixed_4f'
     with tf.variable_scope(end_point):
       with tf.variable_scope('Branch_0'):
-        branch_0 = Unit3D(output_channels=256, kernel_shape=[1, 1, 1],
-                          name='Conv3d_0a_1x1')(net, is_training=is_training)
+        branch_0 = self._unit_3d(output_channels=256, kernel_shape=[1, 1, 1],
+                                 name='Conv3d_0a_1x1')(net,
+                                                       is_training=is_training)
       with tf.variable_scope('Branch_1'):
-        branch_1 = Unit3D(output_channels=160, kernel_shape=[1, 1, 1],
-                          name='Conv3d_0a_1x1')(net, is_training=is_training)
-        branch_1 = Unit3D(output_channels=320, kernel_shape=[3, 3, 3],
-                          name='Conv3d_0b_3x3')(branch_1,
-                                                is_training=is_training)
+        branch_1 = self._unit_3d(output_channels=160, kernel_shape=[1, 1, 1],
+                                 name='Conv3d_0a_1x1')(net,
+                                                       is_training=is_training)
+        branch_1 = self._unit_3d(output_channels=320, kernel_shape=[3, 3, 3],
+                                 name='Conv3d_0b_3x3')(branch_1,
+                                                       is_training=is_training)
       with tf.variable_scope('Branch_2'):
-        branch_2 = Unit3D(output_channels=32, kernel_shape=[1, 1, 1],
-                          name='Conv3d_0a_1x1')(net, is_training=is_training)
-        branch_2 = Unit3D(output_channels=128, kernel_shape=[3, 3, 3],
-                          name='Conv3d_0b_3x3')(branch_2,
-                                                is_training=is_training)
+        branch_2 = self._unit_3d(output_channels=32, kernel_shape=[1, 1, 1],
+                                 name='Conv3d_0a_1x1')(net,
+                                                       is_training=is_training)
+        branch_2 = self._unit_3d(output_channels=128, kernel_shape=[3, 3, 3],
+                                 name='Conv3d_0b_3x3')(branch_2,
+                                                       is_training=is_training)
       with tf.variable_scope('Branch_3'):
         branch_3 = tf.nn.max_pool3d(net, ksize=[1, 3, 3, 3, 1],
                                     strides=[1, 1, 1, 1, 1], padding=snt.SAME,
                                     name='MaxPool3d_0a_3x3')
-        branch_3 = Unit3D(output_channels=128, kernel_shape=[1, 1, 1],
-                          name='Conv3d_0b_1x1')(branch_3,
-                                                is_training=is_training)
+        branch_3 = self._unit_3d(output_channels=128, kernel_shape=[1, 1, 1],
+                                 name='Conv3d_0b_1x1')(branch_3,
+                                                       is_training=is_training)
       net = tf.concat([branch_0, branch_1, branch_2, branch_3], 4)
     end_points[end_point] = net
     if self._final_endpoint == end_point: return net, end_points
@@ -406,27 +444,30 @@ class InceptionI3d(snt.AbstractModule):
     end_point = 'Mixed_5b'
     with tf.variable_scope(end_point):
       with tf.variable_scope('Branch_0'):
-        branch_0 = Unit3D(output_channels=256, kernel_shape=[1, 1, 1],
-                          name='Conv3d_0a_1x1')(net, is_training=is_training)
+        branch_0 = self._unit_3d(output_channels=256, kernel_shape=[1, 1, 1],
+                                 name='Conv3d_0a_1x1')(net,
+                                                       is_training=is_training)
       with tf.variable_scope('Branch_1'):
-        branch_1 = Unit3D(output_channels=160, kernel_shape=[1, 1, 1],
-                          name='Conv3d_0a_1x1')(net, is_training=is_training)
-        branch_1 = Unit3D(output_channels=320, kernel_shape=[3, 3, 3],
-                          name='Conv3d_0b_3x3')(branch_1,
-                                                is_training=is_training)
+        branch_1 = self._unit_3d(output_channels=160, kernel_shape=[1, 1, 1],
+                                 name='Conv3d_0a_1x1')(net,
+                                                       is_training=is_training)
+        branch_1 = self._unit_3d(output_channels=320, kernel_shape=[3, 3, 3],
+                                 name='Conv3d_0b_3x3')(branch_1,
+                                                       is_training=is_training)
       with tf.variable_scope('Branch_2'):
-        branch_2 = Unit3D(output_channels=32, kernel_shape=[1, 1, 1],
-                          name='Conv3d_0a_1x1')(net, is_training=is_training)
-        branch_2 = Unit3D(output_channels=128, kernel_shape=[3, 3, 3],
-                          name='Conv3d_0a_3x3')(branch_2,
-                                                is_training=is_training)
+        branch_2 = self._unit_3d(output_channels=32, kernel_shape=[1, 1, 1],
+                                 name='Conv3d_0a_1x1')(net,
+                                                       is_training=is_training)
+        branch_2 = self._unit_3d(output_channels=128, kernel_shape=[3, 3, 3],
+                                 name='Conv3d_0a_3x3')(branch_2,
+                                                       is_training=is_training)
       with tf.variable_scope('Branch_3'):
         branch_3 = tf.nn.max_pool3d(net, ksize=[1, 3, 3, 3, 1],
                                     strides=[1, 1, 1, 1, 1], padding=snt.SAME,
                                     name='MaxPool3d_0a_3x3')
-        branch_3 = Unit3D(output_channels=128, kernel_shape=[1, 1, 1],
-                          name='Conv3d_0b_1x1')(branch_3,
-                                                is_training=is_training)
+        branch_3 = self._unit_3d(output_channels=128, kernel_shape=[1, 1, 1],
+                                 name='Conv3d_0b_1x1')(branch_3,
+                                                       is_training=is_training)
       net = tf.concat([branch_0, branch_1, branch_2, branch_3], 4)
     end_points[end_point] = net
     if self._final_endpoint == end_point: return net, end_points
@@ -434,27 +475,30 @@ class InceptionI3d(snt.AbstractModule):
     end_point = 'Mixed_5c'
     with tf.variable_scope(end_point):
       with tf.variable_scope('Branch_0'):
-        branch_0 = Unit3D(output_channels=384, kernel_shape=[1, 1, 1],
-                          name='Conv3d_0a_1x1')(net, is_training=is_training)
+        branch_0 = self._unit_3d(output_channels=384, kernel_shape=[1, 1, 1],
+                                 name='Conv3d_0a_1x1')(net,
+                                                       is_training=is_training)
       with tf.variable_scope('Branch_1'):
-        branch_1 = Unit3D(output_channels=192, kernel_shape=[1, 1, 1],
-                          name='Conv3d_0a_1x1')(net, is_training=is_training)
-        branch_1 = Unit3D(output_channels=384, kernel_shape=[3, 3, 3],
-                          name='Conv3d_0b_3x3')(branch_1,
-                                                is_training=is_training)
+        branch_1 = self._unit_3d(output_channels=192, kernel_shape=[1, 1, 1],
+                                 name='Conv3d_0a_1x1')(net,
+                                                       is_training=is_training)
+        branch_1 = self._unit_3d(output_channels=384, kernel_shape=[3, 3, 3],
+                                 name='Conv3d_0b_3x3')(branch_1,
+                                                       is_training=is_training)
       with tf.variable_scope('Branch_2'):
-        branch_2 = Unit3D(output_channels=48, kernel_shape=[1, 1, 1],
-                          name='Conv3d_0a_1x1')(net, is_training=is_training)
-        branch_2 = Unit3D(output_channels=128, kernel_shape=[3, 3, 3],
-                          name='Conv3d_0b_3x3')(branch_2,
-                                                is_training=is_training)
+        branch_2 = self._unit_3d(output_channels=48, kernel_shape=[1, 1, 1],
+                                 name='Conv3d_0a_1x1')(net,
+                                                       is_training=is_training)
+        branch_2 = self._unit_3d(output_channels=128, kernel_shape=[3, 3, 3],
+                                 name='Conv3d_0b_3x3')(branch_2,
+                                                       is_training=is_training)
       with tf.variable_scope('Branch_3'):
         branch_3 = tf.nn.max_pool3d(net, ksize=[1, 3, 3, 3, 1],
                                     strides=[1, 1, 1, 1, 1], padding=snt.SAME,
                                     name='MaxPool3d_0a_3x3')
-        branch_3 = Unit3D(output_channels=128, kernel_shape=[1, 1, 1],
-                          name='Conv3d_0b_1x1')(branch_3,
-                                                is_training=is_training)
+        branch_3 = self._unit_3d(output_channels=128, kernel_shape=[1, 1, 1],
+                                 name='Conv3d_0b_1x1')(branch_3,
+                                                       is_training=is_training)
       net = tf.concat([branch_0, branch_1, branch_2, branch_3], 4)
     end_points[end_point] = net
     if self._final_endpoint == end_point: return net, end_points
@@ -464,12 +508,12 @@ class InceptionI3d(snt.AbstractModule):
       net = tf.nn.avg_pool3d(net, ksize=[1, 2, 7, 7, 1],
                              strides=[1, 1, 1, 1, 1], padding=snt.VALID)
       net = tf.nn.dropout(net, rate=1 - dropout_keep_prob)
-      logits = Unit3D(output_channels=self._num_classes,
-                      kernel_shape=[1, 1, 1],
-                      activation_fn=None,
-                      use_batch_norm=False,
-                      use_bias=True,
-                      name='Conv3d_0c_1x1')(net, is_training=is_training)
+      logits = self._unit_3d(output_channels=self._num_classes,
+                             kernel_shape=[1, 1, 1],
+                             activation_fn=None,
+                             use_batch_norm=False,
+                             use_bias=True,
+                             name='Conv3d_0c_1x1')(net, is_training=is_training)
       if self._spatial_squeeze:
         logits = tf.squeeze(logits, [2, 3], name='SpatialSqueeze')
     averaged_logits = tf.reduce_mean(logits, axis=1)
@@ -0,0 +1,432 @@
+#!/opt/anaconda3/bin/python
+
+"""
+k-Nearest Neighbors with Dynamic Time Warping (DTW) on pose timeseries,
+like `TAKnnDtw` of the CocoaPod, for running it server-side against the
+same label set as `load_dataset`.
+
+A timeseries is an array of shape (num_samples, num_body_parts, 3) with
+the x and y position and the confidence of each body part over time.
+The distance between two timeseries is the sum of the DTW distances of
+the trajectories of all body parts whose average confidence is at least
+`min_confidence` in both timeseries, where the cost of matching two
+points is their Euclidean distance.
+
+Unlike `TAKnnDtw`, the warping path is restricted to a Sakoe-Chiba band
+(|i - j| <= window) everywhere, including the first row and column, so
+series whose lengths differ by more than the window are never matched.
+Most references are never compared with full DTW: candidates are pruned
+with the LB_Kim and LB_Keogh lower bounds, and DTW is abandoned as soon
+as it cannot beat the k-th best distance found so far.
+
+The warping window may be set per class, and an index can be saved as a
+compact .npz file (see `build_dtw_index`, which learns the windows and
+drops redundant references).
+
+Example:
+  ./knn_dtw.py query.npy --reference-dir data/timeseries --k 3
+  ./knn_dtw.py query.npy --index data/dtw_index.npz
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+
+import time
+import heapq
+import argparse
+import collections
+import multiprocessing
+
+import numpy as np
+
+from load_dataset import load_exercise_timeseries
+
+
+_REFERENCE_DIR = 'data/timeseries'
+_LABEL_MAP_PATH = 'data/exercises_label_map.txt'
+
+# Same as `Params` of the example app: 6 second clips at 35 fps
+_WARPING_WINDOW = int(6 * 35 * 0.7)
+_MIN_CONFIDENCE = 0.08
+
+_INDEX_VERSION = 1
+
+
+def dtw_distance(a, b, window, parts=None, best_so_far=np.inf, lower_bounds=None):
+  """
+  Returns the DTW distance between the point trajectories `a` of shape
+  (m, num_parts, 2) and `b` of shape (n, num_parts, 2), summed over the
+  body parts selected by the boolean mask `parts` (default: all).
+
+  The cost matrix is filled one row (point of `b`) at a time, vectorized
+  over the columns in the band and over body parts. If `lower_bounds[i]`
+  is a lower bound of the cost of matching the points i, i + 1, ... of
+  `b` (see `lb_keogh`), DTW is abandoned as soon as the distance is known
+  to be at least `best_so_far`, and `inf` is returned.
+  """
+
+  if parts is not None:
+    a, b = a[:, parts], b[:, parts]
+  m, n = len(a), len(b)
+  if m == 0 or n == 0 or a.shape[1] == 0 or abs(m - n) > window:
+    return np.inf
+
+  # Distances of all pairs of points, of shape (n, num_parts, m)
+  dist = np.sqrt(((b[:, np.newaxis] - a[np.newaxis]) ** 2).sum(axis=-1)).transpose(0, 2, 1)
+
+  # Column j + 1 holds the cost of column j, so column 0 is an infinite border
+  prev = np.full((a.shape[1], m + 1), np.inf)
+  cur = np.full_like(prev, np.inf)
+
+  for i in range(n):
+    lo, hi = max(0, i - window), min(m, i + window + 1)
+    d = dist[i, :, lo:hi]
+
+    if i == 0:
+      row = np.cumsum(d, axis=1)
+    else:
+      # Diagonal and vertical steps come from the previous row
+      step = d + np.minimum(prev[:, lo:hi], prev[:, lo + 1:hi + 1])
+      # Horizontal steps: row[j] = min over k <= j of step[k] + d[k+1:j+1].sum()
+      cum = np.cumsum(d, axis=1)
+      row = cum + np.minimum.accumulate(step - cum, axis=1)
+
+    # The band moves right, so only the column left of it can be stale
+    cur[:, lo] = np.inf
+    cur[:, lo + 1:hi + 1] = row
+    prev, cur = cur, prev
+
+    # The warping path still has to cross all rows after this one
+    remaining = lower_bounds[i + 1] if lower_bounds is not None and i + 1 < n else 0.0
+    if row.min(axis=1).sum() + remaining >= best_so_far:
+      return np.inf
+
+  return prev[:, m].sum()
+
+
+def envelope(a, window, length):
+  """
+  Returns the (upper, lower) envelope of a trajectory `a` of shape
+  (m, num_parts, 2), each of shape (length, num_parts, 2). Row i is the
+  bounding box of the points of `a` which point i of another series may
+  be matched with, or NaN if there are none.
+  """
+
+  shape = (length, ) + a.shape[1:]
+  upper, lower = np.full(shape, np.nan), np.full(shape, np.nan)
+
+  for offset in range(-window, window + 1):
+    # Point i of the other series may be matched with point i + offset of `a`
+    lo, hi = max(0, -offset), min(length, len(a) - offset)
+    if lo < hi:
+      np.fmax(upper[lo:hi], a[lo + offset:hi + offset], out=upper[lo:hi])
+      np.fmin(lower[lo:hi], a[lo + offset:hi + offset], out=lower[lo:hi])
+
+  return upper, lower
+
+
+def lb_keogh(b, upper, lower, parts=None):
+  """
+  Returns the LB_Keogh lower bound of each point of a trajectory `b` of
+  shape (n, num_parts, 2) against the `envelope` of another trajectory:
+  the distance of the point to its bounding box, summed over the body
+  parts selected by `parts`. The sum over all points is a lower bound of
+  their DTW distance.
+  """
+
+  n = len(b)
+  excess = np.maximum(b - upper[:n], 0) + np.maximum(lower[:n] - b, 0)
+  dist = np.sqrt((excess ** 2).sum(axis=-1))
+  if parts is not None:
+    dist = np.where(parts, dist, 0)
+  return dist.sum(axis=-1)
+
+
+class KnnDtw(object):
+  """
+  An index of labeled reference timeseries, searched with kNN-DTW.
+
+  Parameters:
+  - references: a list of timeseries of shape (num_samples, num_body_parts, 3)
+  - labels: the class index of each reference
+  - window: the Sakoe-Chiba warping window, in samples, or a sequence
+    of windows indexed by class, used when comparing with the references
+    of that class
+  - min_confidence: the minimum average confidence of a body part for
+    it to be compared
+  - relevant_parts: indices of the body parts to compare (default: all)
+
+  The number of references pruned by each lower bound, abandoned during
+  DTW, and compared with full DTW are counted in `stats`.
+
+  Example:
+    X, y, _ = load_exercise_timeseries('data/timeseries', 'data/exercises_label_map.txt')
+    knn = KnnDtw(X, y)
+    label, neighbors = knn.classify(query, k=3)
+
+    knn.save('data/dtw_index.npz')
+    knn = KnnDtw.load('data/dtw_index.npz')
+  """
+
+  def __init__(self, references, labels, window=_WARPING_WINDOW,
+               min_confidence=_MIN_CONFIDENCE, relevant_parts=None):
+    assert len(references) == len(labels), 'Expected one label per reference'
+    assert all(len(r) > 0 for r in references), 'Empty reference timeseries'
+
+    points = [np.asarray(r[..., :2], dtype=np.float64) for r in references]
+    confidences = np.stack([np.mean(r[..., 2], axis=0) for r in references])
+    self._build(points, confidences, labels, window, min_confidence, relevant_parts)
+
+  def _build(self, points, confidences, labels, window, min_confidence, relevant_parts):
+    self.window = window
+    self.min_confidence = min_confidence
+    self.labels = np.asarray(labels)
+    self.stats = collections.Counter()
+
+    self._points = points
+    self._lengths = np.array([len(p) for p in self._points])
+    self._confidences = confidences
+    self._confident = confidences >= min_confidence
+
+    # The window of each reference, and the widest one for the LB_Keogh envelope
+    if np.ndim(window) == 0:
+      self._windows = np.full(len(points), int(window))
+    else:
+      self._windows = np.asarray(window, dtype=int)[self.labels]
+    self._max_window = int(self._windows.max())
+
+    num_parts = confidences.shape[1]
+    self._relevant = np.zeros(num_parts, dtype=bool)
+    self._relevant[list(range(num_parts)) if relevant_parts is None else relevant_parts] = True
+
+    # First and last points of all references, for LB_Kim
+    self._first = np.stack([p[0] for p in self._points])
+    self._last = np.stack([p[-1] for p in self._points])
+
+    # All points of all references, for computing LB_Keogh of many at once
+    self._flat = np.concatenate(self._points)
+    self._offsets = np.concatenate([[0], np.cumsum(self._lengths)[:-1]])
+    self._positions = np.concatenate([np.arange(n) for n in self._lengths])
+
+  def __len__(self):
+    return len(self._points)
+
+  def save(self, path):
+    """
+    Writes the index to a .npz file. Points are stored as float32 in one
+    array, so that `load` does not need to unpickle anything.
+    """
+
+    np.savez(path,
+             version=_INDEX_VERSION,
+             points=self._flat.astype(np.float32),
+             lengths=self._lengths,
+             confidences=self._confidences.astype(np.float32),
+             labels=self.labels,
+             window=np.asarray(self.window),
+             min_confidence=self.min_confidence,
+             relevant_parts=self._relevant)
+
+  @classmethod
+  def load(cls, path):
+    """Loads an index written by `save`."""
+
+    with np.load(path) as data:
+      assert int(data['version']) == _INDEX_VERSION, 'Unsupported index version'
+      lengths = data['lengths']
+      points = np.split(data['points'].astype(np.float64), np.cumsum(lengths)[:-1])
+      window = data['window']
+
+      index = cls.__new__(cls)
+      index._build(points, data['confidences'].astype(np.float64), data['labels'],
+                   int(window) if window.ndim == 0 else window.tolist(),
+                   float(data['min_confidence']), np.flatnonzero(data['relevant_parts']))
+    return index
+
+  def distance(self, i, j, window=None):
+    """
+    Returns the DTW distance between references `i` and `j`, with the
+    window of reference `j` by default.
+    """
+
+    window = self._windows[j] if window is None else window
+    parts = self._confident[i] & self._confident[j] & self._relevant
+    return dtw_distance(self._points[i], self._points[j], window, parts=parts)
+
+  def _lb_kim(self, points, parts):
+    first = np.sqrt(((self._first - points[0]) ** 2).sum(axis=-1))
+    last = np.sqrt(((self._last - points[-1]) ** 2).sum(axis=-1))
+    # A path of a single cell matches the first and last points only once
+    last[(self._lengths == 1) & (len(points) == 1)] = 0
+    return np.where(parts, first + last, 0).sum(axis=1)
+
+  def _lb_keogh(self, candidates, upper, lower, parts):
+    """Returns the LB_Keogh of each point of the candidates, and where each candidate starts."""
+
+    lengths = self._lengths[candidates]
+    ends = np.cumsum(lengths)
+    starts = ends - lengths
+    rows = np.arange(ends[-1]) - np.repeat(starts, lengths) \
+      + np.repeat(self._offsets[candidates], lengths)
+
+    positions = self._positions[rows]
+    row_parts = np.repeat(parts[candidates], lengths, axis=0)
+    return lb_keogh(self._flat[rows], upper[positions], lower[positions], row_parts), starts
+
+  def nearest_neighbors(self, query, k=1, max_distance=np.inf):
+    """
+    Finds the `k` references closest to a query timeseries. Only
+    references closer than `max_distance` are returned; a known upper
+    bound of the k-th distance prunes more references from the start.
+
+    Returns:
+    - A list of up to `k` (distance, index) tuples, sorted from the
+      closest reference. References which share no confident body part
+      with the query, or whose length differs by more than the window,
+      are never returned.
+    """
+
+    points = np.asarray(query[..., :2], dtype=np.float64)
+    m = len(points)
+    confident = np.mean(query[..., 2], axis=0) >= self.min_confidence
+    parts = self._confident & confident & self._relevant
+
+    kim = self._lb_kim(points, parts)
+    valid = parts.any(axis=1) & (np.abs(self._lengths - m) <= self._windows)
+    kim[~valid] = np.inf
+    order = np.argsort(kim, kind='stable')
+    order = order[:np.count_nonzero(valid)]
+
+    # Max-heap of the k best (distance, index) so far
+    best = []
+
+    def _best_so_far():
+      return -best[0][0] if len(best) == k else max_distance
+
+    def _compare(idx, lower_bounds=None):
+      dist = dtw_distance(points, self._points[idx], self._windows[idx], parts=parts[idx],
+                          best_so_far=_best_so_far(), lower_bounds=lower_bounds)
+      self.stats['dtw'] += 1
+      if dist == np.inf:
+        self.stats['abandoned'] += 1
+      elif len(best) < k:
+        heapq.heappush(best, (-dist, -idx))
+      elif dist < _best_so_far():
+        heapq.heapreplace(best, (-dist, -idx))
+
+    # The references with the lowest LB_Kim give a first k-th best distance
+    for idx in order[:k]:
+      _compare(idx)
+
+    candidates = order[k:]
+    survivors = candidates[kim[candidates] < _best_so_far()]
+    self.stats['pruned_kim'] += len(candidates) - len(survivors)
+
+    if len(survivors):
+      # The envelope of the widest window bounds DTW with any narrower one
+      upper, lower = envelope(points, self._max_window, m + self._max_window)
+      row_bounds, starts = self._lb_keogh(survivors, upper, lower, parts)
+      keogh = np.maximum(np.add.reduceat(row_bounds, starts), kim[survivors])
+
+      for rank, i in enumerate(np.argsort(keogh, kind='stable')):
+        if keogh[i] >= _best_so_far():
+          self.stats['pruned_keogh'] += len(survivors) - rank
+          break
+        # Lower bound of the cost of all points from each point onwards
+        bounds = row_bounds[starts[i]:starts[i] + self._lengths[survivors[i]]]
+        _compare(survivors[i], lower_bounds=np.cumsum(bounds[::-1])[::-1])
+
+    return sorted((float(-dist), int(-idx)) for dist, idx in best)
+
+  def classify(self, query, k=1):
+    """
+    Classifies a query timeseries by a majority vote of its `k` nearest
+    neighbors. Ties are broken by the lowest total distance.
+
+    Returns:
+    - (label, neighbors): the class index, or None if no reference could
+      be compared, and the (distance, index) of the nearest neighbors.
+    """
+
+    neighbors = self.nearest_neighbors(query, k=k)
+    return self.vote(neighbors), neighbors
+
+  def vote(self, neighbors):
+    """Returns the majority label of a list of (distance, index) neighbors, or None."""
+
+    if not neighbors:
+      return None
+
+    votes = collections.defaultdict(lambda: [0, 0.0])
+    for dist, idx in neighbors:
+      votes[self.labels[idx]][0] += 1
+      votes[self.labels[idx]][1] += dist
+    return int(min(votes, key=lambda y: (-votes[y][0], votes[y][1])))
+
+  def query_many(self, queries, k=1, processes=None):
+    """
+    Returns the `nearest_neighbors` of each query, computed in parallel
+    on a pool of `processes` processes (defaults to # CPUs). The index is
+    copied to each process once, not with every query.
+    """
+
+    if processes == 1:
+      return [self.nearest_neighbors(q, k=k) for q in queries]
+
+    pool = multiprocessing.Pool(processes=processes, initializer=_init_worker, initargs=(self, ))
+    try:
+      return pool.map(_query_worker, [(q, k) for q in queries])
+    finally:
+      pool.close()
+      pool.join()
+
+
+_worker_index = None
+
+
+def _init_worker(index):
+  global _worker_index
+  _worker_index = index
+
+
+def _query_worker(args):
+  query, k = args
+  return _worker_index.nearest_neighbors(query, k=k)
+
+
+def _parse_args():
+  parser = argparse.ArgumentParser(description='Classify pose timeseries with kNN-DTW.')
+  parser.add_argument('queries', nargs='+', help='.npy files with pose timeseries')
+  parser.add_argument('--index', default=None,
+                      help='.npz index written by build_dtw_index.py, instead of --reference-dir')
+  parser.add_argument('--reference-dir', default=_REFERENCE_DIR)
+  parser.add_argument('--label-map', default=_LABEL_MAP_PATH)
+  parser.add_argument('--k', type=int, default=1)
+  parser.add_argument('--window', type=int, default=_WARPING_WINDOW)
+  parser.add_argument('--min-confidence', type=float, default=_MIN_CONFIDENCE)
+  parser.add_argument('--processes', type=int, default=1,
+                      help='number of worker processes for the queries')
+  return parser.parse_args()
+
+
+if __name__ == '__main__':
+  args = _parse_args()
+
+  classes = [x.strip() for x in open(args.label_map)]
+  if args.index:
+    knn = KnnDtw.load(args.index)
+  else:
+    X, y, _ = load_exercise_timeseries(args.reference_dir, args.label_map)
+    knn = KnnDtw(X, y, window=args.window, min_confidence=args.min_confidence)
+  queries = [np.load(q) for q in args.queries]
+
+  start = time.time()
+  results = knn.query_many(queries, k=args.k, processes=args.processes)
+  elapsed = time.time() - start
+
+  for query_file, neighbors in zip(args.queries, results):
+    label = knn.vote(neighbors)
+    print('%s: %s (%s)' % (query_file, 'n/a' if label is None else classes[label], ', '.join(
+      '%s %.3f' % (classes[knn.labels[idx]], dist) for dist, idx in neighbors)))
+
+  print('%d queries against %d references in %.3fs' % (len(queries), len(knn), elapsed))
@@ -1,8 +1,18 @@
 """Load a dataset of exercises. No video pre-processing is done here."""
 
 import os
+import zlib
 from os import path
-from sklearn.model_selection import train_test_split
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+
+_INDEX_NAME = '.dataset_index.npz'
+_INDEX_VERSION = 1
+# Indexes of datasets whose directory is not writable, e.g. read-only mounts
+_INDEX_DIR = 'data/dataset_indexes'
 
 
 def _label(filename):
@@ -13,15 +23,265 @@ def _label(filename):
   return filename_no_uuid
 
 
-def load_exercise_dataset(dataset_dir, label_map_path):
+def _class_ids(label_map_path):
+  """Returns a dictionary of class label -> class index."""
+
+  return {x.strip(): i for i, x in enumerate(open(label_map_path))}
+
+
+def load_exercise_timeseries(dataset_dir, label_map_path, index_path=None):
+  """
+  Loads the pose timeseries of a dataset of people doing exercises. Each
+  timeseries is a `.npy` file named like the video it was extracted from,
+  with an array of shape (num_samples, num_body_parts, 3) holding the x
+  and y position and the confidence of each body part over time.
+
+  Parameters:
+  - dataset_dir (string): path to a directory with `.npy` files, which may be nested
+  - label_map_path (string): path to file with class labels
+  - index_path (string): path to the `DatasetIndex` (default: see `DatasetIndex.open`)
+
+  Returns:
+  - A tuple (X, y, paths) where each X value is a timeseries, the y
+    values are class indices for the X values and paths are their files.
+  """
+
+  index = DatasetIndex.open(dataset_dir, label_map_path, index_path=index_path, probe=False)
+  paths, y = index.videos()
+  X = [np.load(p) for p in paths]
+  return X, y, paths
+
+
+def _list_dir(directory):
+  """Returns the (name, size, mtime) of the files of a directory, and its subdirectories."""
+
+  files, subdirs = [], []
+  for entry in os.scandir(directory):
+    # Hidden files include the index itself and .DS_Store
+    if entry.name.startswith('.'):
+      continue
+    if entry.is_dir():
+      subdirs.append(entry.path)
+    elif entry.is_file():
+      stat = entry.stat()
+      files.append((entry.path, stat.st_size, stat.st_mtime))
+  return files, subdirs
+
+
+def default_index_path(dataset_dir):
+  """
+  Returns the default path of the index of a dataset: `.dataset_index.npz`
+  in `dataset_dir`, or if it is not writable, a file in `data/dataset_indexes`
+  named after the absolute path of `dataset_dir`.
+  """
+
+  if os.access(dataset_dir, os.W_OK):
+    return path.join(dataset_dir, _INDEX_NAME)
+  abs_dir = path.abspath(dataset_dir)
+  name = '%s_%08x.npz' % (path.basename(abs_dir), zlib.crc32(abs_dir.encode('utf-8')))
+  return path.join(_INDEX_DIR, name)
+
+
+def _probe_video(video_file):
+  """Returns the (duration in seconds, frame count) of a video, from its header."""
+
+  cap = cv2.VideoCapture(video_file)
+  frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+  fps = cap.get(cv2.CAP_PROP_FPS)
+  cap.release()
+  return (frame_count / fps if fps > 0 else 0.0), frame_count
+
+
+class DatasetIndex(object):
+  """
+  An index of the videos of a dataset, with their path (relative to
+  `dataset_dir`), class index, size, modification time, duration and
+  frame count, stored as a compact .npz file.
+
+  Videos may be in nested directories. The class of a video is derived
+  from its filename (e.g. `squat_correct_<uuid>.mov`), or else from the
+  name of its directory; files of unknown classes are left out.
+
+  Example:
+    index = DatasetIndex.open('videos', 'data/exercises_label_map.txt')
+    X_train, X_test, y_train, y_test = index.split(test_size=0.2, seed=0)
+  """
+
+  _FIELDS = ('paths', 'labels', 'sizes', 'mtimes', 'durations', 'frame_counts')
+
+  def __init__(self, dataset_dir, classes, paths, labels, sizes, mtimes, durations, frame_counts):
+    self.dataset_dir = dataset_dir
+    self.classes = list(classes)
+    self.paths = np.asarray(paths, dtype=np.str_)
+    self.labels = np.asarray(labels, dtype=np.int32)
+    self.sizes = np.asarray(sizes, dtype=np.int64)
+    self.mtimes = np.asarray(mtimes, dtype=np.float64)
+    self.durations = np.asarray(durations, dtype=np.float32)
+    self.frame_counts = np.asarray(frame_counts, dtype=np.int32)
+    # Number of videos probed by the `scan` which built this index
+    self.num_probed = 0
+
+  def __len__(self):
+    return len(self.paths)
+
+  @classmethod
+  def scan(cls, dataset_dir, label_map_path, previous=None, num_workers=None, probe=True):
+    """
+    Scans `dataset_dir` recursively, listing directories and probing
+    videos on a pool of `num_workers` threads (defaults to # CPUs). Only
+    the videos which are not in the `previous` index, or whose size or
+    modification time changed, are probed. Without `probe`, files are not
+    opened (e.g. for timeseries), and their duration and frame count are 0.
+    """
+
+    assert path.isdir(dataset_dir), 'Invalid directory for dataset'
+    assert path.isfile(label_map_path), 'Invalid label map path'
+
+    class_ids = _class_ids(label_map_path)
+    known = {}
+    if previous is not None:
+      known = {p: i for i, p in enumerate(previous.paths)}
+
+    with ThreadPoolExecutor(max_workers=num_workers or os.cpu_count()) as executor:
+      # Breadth-first, one level of directories at a time
+      files, directories = [], [dataset_dir]
+      while directories:
+        listings = list(executor.map(_list_dir, directories))
+        files.extend(f for level_files, _ in listings for f in level_files)
+        directories = [d for _, subdirs in listings for d in subdirs]
+
+      entries, to_probe = [], []
+      for file_path, size, mtime in sorted(files):
+        name = path.basename(file_path)
+        label = class_ids.get(_label(name), class_ids.get(path.basename(path.dirname(file_path))))
+        if label is None:
+          continue
+
+        rel_path = path.relpath(file_path, dataset_dir)
+        i = known.get(rel_path)
+        if i is not None and previous.sizes[i] == size and previous.mtimes[i] == mtime:
+          entries.append((rel_path, label, size, mtime, previous.durations[i], previous.frame_counts[i]))
+        elif not probe:
+          entries.append((rel_path, label, size, mtime, 0.0, 0))
+        else:
+          to_probe.append(len(entries))
+          entries.append((rel_path, label, size, mtime, 0.0, 0))
+
+      probes = executor.map(_probe_video, [path.join(dataset_dir, entries[i][0]) for i in to_probe])
+      for i, (duration, frame_count) in zip(to_probe, probes):
+        entries[i] = entries[i][:4] + (duration, frame_count)
+
+    skipped = len(files) - len(entries)
+    if skipped:
+      print('Skipped %d files of unknown classes in %s' % (skipped, dataset_dir))
+
+    columns = list(zip(*entries)) if entries else [[]] * len(cls._FIELDS)
+    classes = sorted(class_ids, key=class_ids.get)
+    index = cls(dataset_dir, classes, *columns)
+    index.num_probed = len(to_probe)
+    return index
+
+  def save(self, index_path):
+    tmp_path = index_path + '.tmp.npz'
+    np.savez(tmp_path, version=_INDEX_VERSION, classes=np.asarray(self.classes, dtype=np.str_),
+             **{field: getattr(self, field) for field in self._FIELDS})
+    os.replace(tmp_path, index_path)
+
+  @classmethod
+  def load(cls, dataset_dir, index_path):
+    with np.load(index_path) as data:
+      if int(data['version']) != _INDEX_VERSION:
+        raise ValueError('Unsupported dataset index version in %s' % index_path)
+      return cls(dataset_dir, data['classes'].tolist(), *[data[field] for field in cls._FIELDS])
+
+  @classmethod
+  def open(cls, dataset_dir, label_map_path, index_path=None, update=True, num_workers=None,
+           probe=True):
+    """
+    Loads the index of a dataset from `index_path`, by default
+    `default_index_path(dataset_dir)`. The index is built if it does not
+    exist yet, and with `update`, brought up to date with the files of the
+    dataset. Without `update`, no directory is scanned, which is the
+    cheapest for large datasets that did not change. If the index cannot
+    be written, it is used without saving it.
+    """
+
+    index_path = index_path or default_index_path(dataset_dir)
+    previous = None
+    if path.isfile(index_path):
+      try:
+        previous = cls.load(dataset_dir, index_path)
+      except (ValueError, KeyError, OSError):
+        previous = None
+
+    classes = list(_class_ids(label_map_path))
+    if previous is not None and not update and previous.classes == classes:
+      return previous
+
+    index = cls.scan(dataset_dir, label_map_path, previous=previous, num_workers=num_workers,
+                     probe=probe)
+    if previous is None or index.classes != previous.classes or len(index) != len(previous) \
+        or any((getattr(index, f) != getattr(previous, f)).any() for f in ('paths', 'sizes', 'mtimes')):
+      try:
+        if path.dirname(index_path):
+          os.makedirs(path.dirname(index_path), exist_ok=True)
+        index.save(index_path)
+      except OSError as e:
+        print('Dataset index not saved to %s: %s' % (index_path, e))
+    return index
+
+  def videos(self):
+    """
+    Returns a tuple (X, y) where each X value is the path of a video (or
+    other file), and the y values are class indices for the X values.
+    """
+
+    return [path.join(self.dataset_dir, p) for p in self.paths], self.labels.tolist()
+
+  def split(self, test_size=0.2, seed=0):
+    """
+    Splits the videos into a train and a test set, with the same share
+    `test_size` of each class in the test set. Videos are assigned by a
+    hash of their path and `seed`, so adding videos to the dataset does
+    not move the others between sets.
+
+    Returns:
+    - A tuple (X_train, X_test, y_train, y_test), like `load_exercise_dataset`.
+    """
+
+    keys = np.array([zlib.crc32(('%s:%s' % (seed, p)).encode('utf-8')) for p in self.paths])
+    test = np.zeros(len(self), dtype=bool)
+    for c in np.unique(self.labels):
+      members = np.flatnonzero(self.labels == c)
+      members = members[np.argsort(keys[members], kind='stable')]
+      test[members[:int(round(len(members) * test_size))]] = True
+
+    # Shuffle within each set, reproducibly
+    order = np.random.RandomState(seed).permutation(len(self))
+    X, y = self.videos()
+    train_order, test_order = order[~test[order]], order[test[order]]
+    return ([X[i] for i in train_order], [X[i] for i in test_order],
+            [y[i] for i in train_order], [y[i] for i in test_order])
+
+
+def load_exercise_dataset(dataset_dir, label_map_path, test_size=0.2, seed=0,
+                          index_path=None, update_index=True):
   """
   Loads a dataset of videos of people doing exercises. The filename
   of the video is matched against the list of classes in order to
   determine the correct class label for each video.
 
+  Videos are listed from a `DatasetIndex`, which is updated
+  incrementally, and split into a train and test set stratified by
+  class. The same `seed` gives the same split.
+
   Parameters:
-  - dataset_dir (string): path to a directory with videos
+  - dataset_dir (string): path to a directory with videos, which may be nested
   - label_map_path (string): path to file with class labels
+  - test_size (float): share of the videos of each class in the test set
+  - seed (int): seed of the split
+  - index_path (string): path to the index (default: see `DatasetIndex.open`)
+  - update_index (bool): whether to bring the index up to date with the files
 
   Returns:
   - A tuple (X_train, X_test, y_train, y_test) where the y values
@@ -29,15 +289,6 @@ def load_exercise_dataset(dataset_dir, label_map_path):
     pointing to the file path of a video.
   """
 
-  assert path.isdir(dataset_dir), 'Invalid directory for dataset'
-  assert path.isfile(label_map_path), 'Invalid label map path'
-
-  invalid = ['.DS_Store', '.', '..']
-  filenames = [f for f in os.listdir(dataset_dir) if f not in invalid]
-  X = [path.join(dataset_dir, f) for f in filenames]
-
-  classes = [x.strip() for x in open(label_map_path)]
-  y = [classes.index(_label(f)) for f in filenames]
-
-  # Split the data into train/test
-  return train_test_split(X, y, test_size=0.2, shuffle=True)
+  index = DatasetIndex.open(dataset_dir, label_map_path, index_path=index_path,
+                            update=update_index)
+  return index.split(test_size=test_size, seed=seed)
@@ -0,0 +1,329 @@
+#!/opt/anaconda3/bin/python
+
+"""
+Data-parallel training of the heads of the two-stream model on the CPUs
+of a single machine.
+
+Each of `num_workers` worker processes holds a replica of the model, and
+computes the gradients of the head variables (`build_graph.HEAD_VARIABLES`)
+on its own shard of every epoch. The coordinator averages the gradients
+of all workers at every step, weighted by their batch sizes, and sends
+the average back. Every worker then applies it with the Adam optimizer
+of its training graph (see `build_graph.build_gradient_ops`), so the
+optimizer slots are the same as in the checkpoints of
+`train_model.train`. Before training, the coordinator copies the head
+variables of worker 0 to every other worker, so all replicas start from
+the same weights even without a training checkpoint, and they stay
+identical by applying the same updates. Apart from that copy, only
+gradients and losses go through the pipes between processes, which is
+a few tens of KB per step.
+
+Each worker is pinned to its own contiguous range of CPUs, and its
+TensorFlow thread pools are sized to match, so that workers do not
+compete for cores. Evaluation is sharded over the workers as well, and
+worker 0 writes the checkpoints.
+
+Unlike `train_model.train`, only the head variables are updated, and no
+TensorBoard summaries are written; the loss and accuracies are logged to
+the same statistics as `train_model.train`.
+
+Example:
+  ./parallel_training.py --workers 4 --epochs 25 --head-only
+
+A quick smoke run with two workers on a few videos:
+  ./parallel_training.py --workers 2 --epochs 2 --max-videos 8 --cache-dir /tmp/smoke_cache
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+import time
+import argparse
+import traceback
+import multiprocessing
+
+import numpy as np
+import tensorflow as tf
+
+from build_graph import build_gradient_ops, config_name, HEAD_VARIABLES
+from build_graph import FINAL_ENDPOINT, NUM_FRAMES, IMAGE_SIZE, CHECKPOINT_PATHS
+from evaluate import evaluate, merge_metrics, format_metrics
+from load_dataset import load_exercise_dataset
+from persistence import AsyncSaver
+from prefetch import Prefetcher
+from process_video import SAMPLINGS, rgb_to_float
+from timing import StageTimer
+from train_model import build_training_graph, restore_checkpoints, open_stats, split_train_val
+from train_model import InputPipeline
+
+
+_VIDEO_DIR = 'videos'
+_LABEL_MAP_PATH = 'data/exercises_label_map.txt'
+_CACHE_DIR = 'data/cache'
+
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
+
+
+def _cpu_slices(num_workers):
+  """
+  Splits the CPUs this process may run on into `num_workers` contiguous
+  ranges, or returns no CPUs if there are too few to split (or CPU
+  affinity is not supported).
+  """
+
+  if not hasattr(os, 'sched_getaffinity'):
+    return [[] for _ in range(num_workers)]
+  cpus = sorted(os.sched_getaffinity(0))
+  if len(cpus) < num_workers:
+    return [[] for _ in range(num_workers)]
+  return [[int(cpu) for cpu in chunk] for chunk in np.array_split(cpus, num_workers)]
+
+
+def _recv(conn, kind):
+  """Receives a message of the given kind, re-raising the errors of the other end."""
+
+  msg = conn.recv()
+  if msg[0] == 'error':
+    raise RuntimeError('Training worker failed:\n%s' % msg[1])
+  if msg[0] != kind:
+    raise RuntimeError('Expected a %r message from the other end, got %r' % (kind, msg[0]))
+  return msg[1:]
+
+
+def _worker(rank, conn, cpus, settings):
+  """Entry point of a worker process, which serves the requests of the coordinator."""
+
+  async_saver = None
+  try:
+    if cpus:
+      os.sched_setaffinity(0, cpus)
+
+    tf.logging.set_verbosity(tf.logging.INFO)
+    config = dict(final_endpoint=settings['final_endpoint'], num_frames=settings['num_frames'],
+                  image_size=settings['image_size'])
+    training_checkpoint = CHECKPOINT_PATHS['training'].format(config_name(**config))
+
+    backbone, inputs, outputs, savers, _ = build_training_graph(
+      settings['beta'], head_only=settings['head_only'], **config)
+    learning_rate, rgb_input, flow_input, is_training, y = inputs
+    scores, loss, _ = outputs
+    gradients, gradient_inputs, apply_gradients = build_gradient_ops(loss)
+
+    # Without CPUs of its own (0), a worker uses the default thread pools of TensorFlow
+    session_config = tf.ConfigProto(intra_op_parallelism_threads=len(cpus),
+                                    inter_op_parallelism_threads=min(len(cpus), 2))
+
+    with tf.Session(config=session_config) as sess:
+      sess.run(tf.global_variables_initializer())
+      restore_checkpoints(sess, savers, training_checkpoint)
+      pipeline = InputPipeline(sess, backbone=backbone, cache_dir=settings['cache_dir'],
+                               sampling=settings['sampling'], frame_step=settings['frame_step'],
+                               **config)
+      head_vars = tf.get_collection(HEAD_VARIABLES)
+      if rank == 0:
+        async_saver = AsyncSaver(head_vars, sess)
+      timer = StageTimer()
+      # Without a training checkpoint, the heads of each worker are initialized at random
+      conn.send(('ready', sess.run(head_vars) if rank == 0 else None))
+
+      while True:
+        msg = conn.recv()
+        if msg[0] == 'stop':
+          break
+
+        elif msg[0] == 'save':
+          async_saver.save(training_checkpoint)
+
+        elif msg[0] == 'weights':
+          for var, value in zip(head_vars, msg[1]):
+            var.load(value, sess)
+
+        elif msg[0] == 'evaluate':
+          results = evaluate(sess, (rgb_input, flow_input), scores, msg[1], pipeline.preprocess,
+                             batch_size=settings['eval_batch_size'],
+                             prefetch_depth=settings['prefetch_depth'], feed_dict={is_training: 0})
+          conn.send(('evaluated', results))
+
+        elif msg[0] == 'train':
+          train_inputs = Prefetcher(msg[1], pipeline.preprocess_batch,
+                                    depth=settings['prefetch_depth'])
+          wait_time = train_inputs.wait_time
+          for batch, (rgb, flow, prep_timings) in train_inputs:
+            timer.add_all(prep_timings)
+            timer.add('input_wait', train_inputs.wait_time - wait_time)
+            wait_time = train_inputs.wait_time
+
+            feed_dict = {
+              rgb_input: rgb_to_float(rgb),
+              flow_input: flow,
+              y: np.array([y_class for _, y_class in batch]),
+              is_training: 1
+            }
+            with timer.stage('sess_run'):
+              loss_np, gradients_np = sess.run([loss, gradients], feed_dict=feed_dict)
+
+            # Waiting for the average includes waiting for the slowest worker
+            with timer.stage('exchange'):
+              conn.send(('gradients', gradients_np, len(batch), float(loss_np)))
+              average, = _recv(conn, 'average')
+
+            with timer.stage('apply'):
+              feed_dict = dict(zip(gradient_inputs, average))
+              feed_dict[learning_rate] = settings['lr']
+              sess.run(apply_gradients, feed_dict=feed_dict)
+            timer.end_step()
+
+          conn.send(('trained', timer.table()))
+
+  except Exception:
+    conn.send(('error', traceback.format_exc()))
+  finally:
+    if async_saver is not None:
+      async_saver.close()
+    conn.close()
+
+
+def train_parallel(num_workers, num_epochs, beta, lr, cache_dir=_CACHE_DIR, prefetch_depth=2,
+                   batch_size=1, head_only=False, eval_batch_size=8, final_endpoint=FINAL_ENDPOINT,
+                   num_frames=NUM_FRAMES, image_size=IMAGE_SIZE, sampling='center', frame_step=2,
+                   index_path=None, max_videos=None):
+  """
+  Trains the heads of the two-stream model on `num_workers` processes.
+  The arguments are the same as for `train_model.train`, where
+  `batch_size` is the batch size of each worker, so each step trains on
+  up to `num_workers * batch_size` videos.
+
+  Every epoch, the training batches are dealt to the workers in turn.
+  Workers step in sync, so the last `len(batches) % num_workers`
+  batches of an epoch are skipped; as the training and validation sets
+  are re-sampled every epoch, these are different videos every time.
+  If `max_videos` is given, only the first `max_videos` videos of the
+  training set are used, which is meant for smoke runs.
+  """
+
+  tf.logging.set_verbosity(tf.logging.INFO)
+
+  X_train_initial, _, y_train_initial, _ = load_exercise_dataset(_VIDEO_DIR, _LABEL_MAP_PATH,
+                                                                 index_path=index_path)
+  X_train_initial, y_train_initial = np.array(X_train_initial), np.array(y_train_initial)
+  if max_videos is not None:
+    X_train_initial, y_train_initial = X_train_initial[:max_videos], y_train_initial[:max_videos]
+  validation_cutoff = int(X_train_initial.shape[0] * 0.2)
+  classes = [x.strip() for x in open(_LABEL_MAP_PATH)]
+  stats = open_stats()
+
+  settings = dict(beta=beta, lr=lr, cache_dir=cache_dir, prefetch_depth=prefetch_depth,
+                  head_only=head_only, eval_batch_size=eval_batch_size,
+                  final_endpoint=final_endpoint, num_frames=num_frames, image_size=image_size,
+                  sampling=sampling, frame_step=frame_step)
+
+  # TensorFlow is not fork-safe, so workers start from a fresh interpreter
+  context = multiprocessing.get_context('spawn')
+  conns, workers = [], []
+  for rank, cpus in enumerate(_cpu_slices(num_workers)):
+    conn, worker_conn = context.Pipe()
+    worker = context.Process(target=_worker, args=(rank, worker_conn, cpus, settings))
+    worker.start()
+    worker_conn.close()
+    conns.append(conn)
+    workers.append(worker)
+    tf.logging.info('Worker %d started on CPUs %s' % (rank, cpus or 'all'))
+
+  try:
+    head_values = [_recv(conn, 'ready')[0] for conn in conns][0]
+    for conn in conns[1:]:
+      conn.send(('weights', head_values))
+
+    t = 0
+    for epoch in range(num_epochs):
+      print('Starting epoch %d' % epoch)
+      train_dset, val_dset = split_train_val(X_train_initial, y_train_initial, validation_cutoff)
+
+      if epoch != 0:
+        conns[0].send(('save', ))
+
+        # Each worker evaluates every num_workers-th video of each dataset
+        dsets = {'Train': train_dset, 'Val': val_dset}
+        for rank, conn in enumerate(conns):
+          conn.send(('evaluate', {name: dset[rank::num_workers] for name, dset in dsets.items()}))
+        shards = [_recv(conn, 'evaluated')[0] for conn in conns]
+
+        for name in dsets:
+          metrics = merge_metrics([results[name] for results in shards])
+          print(format_metrics(name, metrics, classes=classes))
+          stats.append(name.lower() + '_acc', metrics['accuracy'])
+        stats.flush()
+
+      batches = [train_dset[i:i + batch_size] for i in range(0, len(train_dset), batch_size)]
+      num_steps = len(batches) // num_workers
+      for rank, conn in enumerate(conns):
+        conn.send(('train', batches[rank::num_workers][:num_steps]))
+
+      start = time.time()
+      for _ in range(num_steps):
+        replies = [_recv(conn, 'gradients') for conn in conns]
+        weights = np.array([num_samples for _, num_samples, _ in replies], dtype=np.float64)
+        weights /= weights.sum()
+
+        average = [sum(w * grads[i] for w, (grads, _, _) in zip(weights, replies))
+                   for i in range(len(replies[0][0]))]
+        for conn in conns:
+          conn.send(('average', average))
+
+        loss_np = sum(w * loss for w, (_, _, loss) in zip(weights, replies))
+        stats.append('loss', loss_np)
+        print('Iteration %d, loss = %.4f' % (t, loss_np))
+        t += 1
+
+      tables = [_recv(conn, 'trained')[0] for conn in conns]
+      tf.logging.info('Epoch %d: %d steps on %d workers in %.1fs' % (
+        epoch, num_steps, num_workers, time.time() - start))
+      tf.logging.info('Time per stage of worker 0 after epoch %d:\n%s' % (epoch, tables[0]))
+
+  finally:
+    # Checkpoints are saved at the start of each epoch, so the last one is saved here
+    for rank, conn in enumerate(conns):
+      try:
+        if rank == 0:
+          conn.send(('save', ))
+        conn.send(('stop', ))
+      except (OSError, EOFError):
+        pass
+    for worker in workers:
+      worker.join()
+    stats.close()
+
+
+def _parse_args():
+  parser = argparse.ArgumentParser(description='Train the model on several processes.')
+  parser.add_argument('--workers', type=int, default=2)
+  parser.add_argument('--epochs', type=int, default=25)
+  parser.add_argument('--beta', type=float, default=0.25)
+  parser.add_argument('--lr', type=float, default=5e-4)
+  parser.add_argument('--batch-size', type=int, default=1, help='batch size of each worker')
+  parser.add_argument('--eval-batch-size', type=int, default=8)
+  parser.add_argument('--prefetch-depth', type=int, default=2)
+  parser.add_argument('--cache-dir', default=_CACHE_DIR)
+  parser.add_argument('--head-only', action='store_true',
+                      help='run the frozen backbone once per video, and train on cached features')
+  parser.add_argument('--final-endpoint', default=FINAL_ENDPOINT)
+  parser.add_argument('--num-frames', type=int, default=NUM_FRAMES)
+  parser.add_argument('--image-size', type=int, default=IMAGE_SIZE)
+  parser.add_argument('--sampling', choices=SAMPLINGS, default='center')
+  parser.add_argument('--frame-step', type=int, default=2)
+  parser.add_argument('--index-path', default=None,
+                      help='dataset index (default: in the video directory, if it is writable)')
+  parser.add_argument('--max-videos', type=int, default=None,
+                      help='train on the first videos only, for smoke runs')
+  return parser.parse_args()
+
+
+if __name__ == '__main__':
+  args = _parse_args()
+  train_parallel(args.workers, args.epochs, args.beta, args.lr, cache_dir=args.cache_dir,
+                 prefetch_depth=args.prefetch_depth, batch_size=args.batch_size,
+                 head_only=args.head_only, eval_batch_size=args.eval_batch_size,
+                 final_endpoint=args.final_endpoint, num_frames=args.num_frames,
+                 image_size=args.image_size, sampling=args.sampling, frame_step=args.frame_step,
+                 index_path=args.index_path, max_videos=args.max_videos)
@@ -0,0 +1,162 @@
+"""
+Saves checkpoints and training statistics without stalling training:
+checkpoints are written in the background from a snapshot of the
+variables, and statistics are appended to a log instead of rewritten.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import tensorflow as tf
+
+
+class AsyncSaver(object):
+  """
+  Writes checkpoints of `var_list` on a background thread. `save` only
+  copies the current values of the variables out of the training session;
+  they are written from a separate graph and session, so training can go
+  on while the checkpoint is written. Variables are saved under their op
+  names, so the checkpoints can be restored by a `tf.train.Saver` of the
+  same variables.
+
+  Only one checkpoint is written at a time: `save` waits for the previous
+  one to be written first. Errors of the background write are raised by
+  the next `save`, `wait` or `close`.
+
+  Example:
+    saver = AsyncSaver(tf.get_collection(HEAD_VARIABLES), sess)
+    saver.save('data/checkpoints/training/model.ckpt')
+    ...
+    saver.close()
+  """
+
+  def __init__(self, var_list, sess):
+    self._sess = sess
+    self._variables = list(var_list)
+    self._executor = ThreadPoolExecutor(max_workers=1)
+    self._pending = None
+
+    self._graph = tf.Graph()
+    with self._graph.as_default():
+      snapshot_vars = {}
+      self._placeholders, self._assigns = [], []
+      for var in self._variables:
+        dtype, shape = var.dtype.base_dtype, var.shape
+        snapshot_var = tf.Variable(tf.zeros(shape, dtype), trainable=False)
+        placeholder = tf.placeholder(dtype, shape)
+        snapshot_vars[var.op.name] = snapshot_var
+        self._placeholders.append(placeholder)
+        self._assigns.append(tf.assign(snapshot_var, placeholder))
+      self._saver = tf.train.Saver(var_list=snapshot_vars, reshape=True)
+    self._snapshot_sess = tf.Session(graph=self._graph)
+
+  def save(self, save_path):
+    """Snapshots the variables, and starts writing them to `save_path`."""
+
+    self.wait()
+    values = self._sess.run(self._variables)
+    self._pending = self._executor.submit(self._write, values, save_path)
+
+  def _write(self, values, save_path):
+    self._snapshot_sess.run(self._assigns, feed_dict=dict(zip(self._placeholders, values)))
+    path = self._saver.save(self._snapshot_sess, save_path, write_meta_graph=False)
+    tf.logging.info('Training model saved in path: %s' % path)
+    return path
+
+  def wait(self):
+    """Waits for the pending checkpoint, and returns its path (or None)."""
+
+    pending, self._pending = self._pending, None
+    return pending.result() if pending is not None else None
+
+  def close(self):
+    try:
+      self.wait()
+    finally:
+      self._executor.shutdown()
+      self._snapshot_sess.close()
+
+
+class MetricsLog(object):
+  """
+  An append-only log of scalar metrics (e.g. loss, accuracies), with one
+  file of raw float64 values per metric in `log_dir`. Values are buffered
+  and appended in chunks of `chunk_size`, or by `flush`, so the cost of
+  persisting them does not grow with the length of the run.
+
+  Example:
+    stats = MetricsLog('data/stats')
+    stats.append('loss', 0.25)
+    stats.flush()
+    losses = stats.load('loss')
+    ...
+    stats.close()
+  """
+
+  def __init__(self, log_dir, chunk_size=1024):
+    self.log_dir = log_dir
+    self.chunk_size = chunk_size
+    self._buffers = {}
+    self._closed = False
+
+    if not os.path.exists(log_dir):
+      os.makedirs(log_dir)
+
+  def _path(self, name):
+    return os.path.join(self.log_dir, name + '.float64')
+
+  def append(self, name, value):
+    if self._closed:
+      raise ValueError('Cannot append to a closed MetricsLog')
+    buf = self._buffers.setdefault(name, [])
+    buf.append(float(value))
+    if len(buf) >= self.chunk_size:
+      self._write(name)
+
+  def extend(self, name, values):
+    for value in values:
+      self.append(name, value)
+
+  def _write(self, name):
+    buf = self._buffers.get(name)
+    if buf:
+      with open(self._path(name), 'ab') as f:
+        # Drop an incomplete value left by an interrupted append
+        partial = f.tell() % 8
+        if partial:
+          f.truncate(f.tell() - partial)
+        f.write(np.array(buf, dtype=np.float64).tobytes())
+      self._buffers[name] = []
+
+  def flush(self):
+    """Appends the buffered values of all metrics to their files."""
+
+    for name in list(self._buffers):
+      self._write(name)
+
+  def close(self):
+    """Appends the buffered values, after which no more values can be appended."""
+
+    self.flush()
+    self._closed = True
+
+  def load(self, name):
+    """Returns all values of a metric, including the buffered ones."""
+
+    path = self._path(name)
+    values = np.array([], dtype=np.float64)
+    if os.path.isfile(path):
+      # Until the next append, an interrupted one may have left an incomplete value
+      with open(path, 'rb') as f:
+        data = f.read()
+      values = np.frombuffer(data[:len(data) - len(data) % 8], dtype=np.float64)
+    return np.concatenate([values, self._buffers.get(name, [])])
+
+  def count(self, name):
+    path = self._path(name)
+    size = os.path.getsize(path) // 8 if os.path.isfile(path) else 0
+    return size + len(self._buffers.get(name, []))
@@ -0,0 +1,71 @@
+"""
+Prepares the inputs of upcoming training steps in the background while
+the current step runs.
+"""
+
+import time
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Prefetcher(object):
+  """
+  Iterates over `fn(item)` for every item of `items`, in order. Up to
+  `depth` results are computed ahead of the consumer on a pool of
+  `num_workers` threads, so the consumer only blocks when preparing an
+  item is slower than consuming one.
+
+  The total time the consumer spent blocked is available as `wait_time`.
+
+  Example:
+    for x, (rgb, flow) in Prefetcher(videos, rgb_flow_data, depth=4):
+      ...
+  """
+
+  def __init__(self, items, fn, depth=2, num_workers=1):
+    assert depth > 0, 'Prefetch depth must be positive'
+    self._items = iter(items)
+    self._fn = fn
+    self._depth = depth
+    self._num_workers = num_workers
+    self.wait_time = 0.0
+    self.num_items = 0
+
+  def _submit(self, executor, pending):
+    try:
+      item = next(self._items)
+    except StopIteration:
+      return False
+    pending.append((item, executor.submit(self._fn, item)))
+    return True
+
+  def __iter__(self):
+    pending = collections.deque()
+
+    with ThreadPoolExecutor(max_workers=self._num_workers) as executor:
+      try:
+        while len(pending) < self._depth and self._submit(executor, pending):
+          pass
+
+        while pending:
+          item, future = pending.popleft()
+
+          start = time.time()
+          result = future.result()
+          self.wait_time += time.time() - start
+          self.num_items += 1
+
+          # Keep the queue full while the consumer works on this item
+          self._submit(executor, pending)
+          yield item, result
+      finally:
+        for _, future in pending:
+          future.cancel()
+
+  def report(self, msg):
+    """Returns a printable summary of the time spent waiting for inputs."""
+
+    avg = self.wait_time / max(self.num_items, 1)
+    return '%s: waited %.2fs for %d inputs (%.3fs per input)' % (
+      msg, self.wait_time, self.num_items, avg
+    )
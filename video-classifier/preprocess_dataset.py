@@ -0,0 +1,156 @@
+#!/opt/anaconda3/bin/python
+
+"""
+Pre-processes every video of the exercise dataset into RGB and optical
+flow tensors ahead of training, using a pool of processes. The tensors
+are written to the same sharded layout that `video_cache` reads from, so
+training picks them up without decoding any video.
+
+The tool can be interrupted and restarted at any time: videos which are
+already pre-processed are skipped.
+
+Example:
+  ./preprocess_dataset.py --processes 16
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+import json
+import time
+import argparse
+import multiprocessing
+from os import path
+
+import cv2
+
+from process_video import SAMPLINGS, NUM_FRAMES, IMAGE_SIZE
+from load_dataset import DatasetIndex
+from video_cache import cache_key, cache_paths, is_cached, cached_rgb_flow_data
+
+
+_VIDEO_DIR = 'videos'
+_LABEL_MAP_PATH = 'data/exercises_label_map.txt'
+_OUTPUT_DIR = 'data/cache'
+_MANIFEST_NAME = 'manifest.json'
+
+
+def _init_worker():
+  # Parallelism comes from the pool, so keep each worker single-threaded
+  cv2.setNumThreads(1)
+
+
+def _process(job):
+  video_file, output_dir, size, nframes, sampling, frame_step = job
+  start = time.time()
+  cached_rgb_flow_data(video_file, size, nframes=nframes, cache_dir=output_dir,
+                       num_workers=1, sampling=sampling, frame_step=frame_step)
+  return video_file, time.time() - start
+
+
+def _manifest_entry(video_file, label, output_dir, size, nframes, sampling, frame_step):
+  key = cache_key(video_file, size, nframes=nframes, sampling=sampling, frame_step=frame_step)
+  rgb_path, flow_path = cache_paths(output_dir, key)
+  return {
+    'video': video_file,
+    'label': label,
+    'key': key,
+    'rgb': path.relpath(rgb_path, output_dir),
+    'flow': path.relpath(flow_path, output_dir)
+  }
+
+
+def _write_manifest(output_dir, entries, size, nframes, sampling, frame_step):
+  manifest = {
+    'image_size': size,
+    'num_frames': nframes,
+    'sampling': sampling,
+    'frame_step': frame_step,
+    'videos': entries
+  }
+
+  manifest_path = path.join(output_dir, _MANIFEST_NAME)
+  tmp_path = manifest_path + '.tmp'
+  with open(tmp_path, 'w') as f:
+    json.dump(manifest, f, indent=2)
+  os.replace(tmp_path, manifest_path)
+  return manifest_path
+
+
+def preprocess_dataset(video_dir, label_map_path, output_dir,
+                       processes=None, size=IMAGE_SIZE, nframes=NUM_FRAMES,
+                       sampling='center', frame_step=2, index_path=None):
+  """
+  Pre-processes all videos in `video_dir` into `output_dir` and writes a
+  manifest listing the label and tensor files of every video.
+
+  Parameters:
+  - video_dir (string): path to a directory with videos, which may be nested
+  - label_map_path (string): path to file with class labels
+  - output_dir (string): cache directory the tensors are written to
+  - processes (int): number of worker processes (defaults to # CPUs)
+  - size (int): size of the square center crop, in pixels
+  - nframes (int): number of frames per video
+  - sampling (string): which frames are loaded, one of `process_video.SAMPLINGS`
+  - frame_step (int): distance between loaded frames with 'stride' sampling
+  - index_path (string): path to the `DatasetIndex` of `video_dir`, which
+    training reads too (default: see `DatasetIndex.open`)
+
+  Returns:
+  - The path of the manifest file
+  """
+
+  X, y = DatasetIndex.open(video_dir, label_map_path, index_path=index_path).videos()
+  os.makedirs(output_dir, exist_ok=True)
+
+  todo = [x for x in X if not is_cached(x, size, nframes=nframes, cache_dir=output_dir,
+                                        sampling=sampling, frame_step=frame_step)]
+  print('{} videos, {} already pre-processed'.format(len(X), len(X) - len(todo)))
+
+  if todo:
+    jobs = [(x, output_dir, size, nframes, sampling, frame_step) for x in todo]
+    pool = multiprocessing.Pool(processes=processes, initializer=_init_worker)
+    try:
+      results = pool.imap_unordered(_process, jobs)
+      for i, (video_file, elapsed) in enumerate(results):
+        print('[%d/%d] %s (%.2fs)' % (i + 1, len(todo), video_file, elapsed))
+      pool.close()
+    except:
+      pool.terminate()
+      raise
+    finally:
+      pool.join()
+
+  entries = [_manifest_entry(x, label, output_dir, size, nframes, sampling, frame_step)
+             for x, label in zip(X, y)]
+  return _write_manifest(output_dir, entries, size, nframes, sampling, frame_step)
+
+
+def _parse_args():
+  parser = argparse.ArgumentParser(description='Pre-process the exercise dataset.')
+  parser.add_argument('--video-dir', default=_VIDEO_DIR)
+  parser.add_argument('--label-map', default=_LABEL_MAP_PATH)
+  parser.add_argument('--output-dir', default=_OUTPUT_DIR)
+  parser.add_argument('--processes', type=int, default=None,
+                      help='number of worker processes (default: # CPUs)')
+  parser.add_argument('--image-size', type=int, default=IMAGE_SIZE)
+  parser.add_argument('--num-frames', type=int, default=NUM_FRAMES)
+  parser.add_argument('--sampling', choices=SAMPLINGS, default='center')
+  parser.add_argument('--frame-step', type=int, default=2,
+                      help='distance between frames with --sampling stride')
+  parser.add_argument('--index-path', default=None,
+                      help='dataset index (default: in --video-dir, if it is writable)')
+  return parser.parse_args()
+
+
+if __name__ == '__main__':
+  args = _parse_args()
+  manifest_path = preprocess_dataset(args.video_dir, args.label_map, args.output_dir,
+                                     processes=args.processes,
+                                     size=args.image_size,
+                                     nframes=args.num_frames,
+                                     sampling=args.sampling,
+                                     frame_step=args.frame_step,
+                                     index_path=args.index_path)
+  print('Manifest written to %s' % manifest_path)
@@ -3,19 +3,29 @@ Provides functions for processing a video file into numpy arrays
 for RGB data and optical flow data, which can be used with the I3D model.
 """
 
+import os
+import time
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
 import cv2
 import numpy as np
 from matplotlib import pyplot as plt
 
 
-def _raw_numpy_array(video_file, nframes=None):
+# Default number of frames and size (in pixels) of the inputs of the model
+NUM_FRAMES = 140
+IMAGE_SIZE = 224
+
+
+def _open_video(video_file):
   """
-  Loads a video from the given file. Will set the number
-  of frames to `nframes` if this parameter is not `None`.
+  Opens a video for reading.
 
   Returns:
-  - (width, height, arr): The width and height of the video,
-    and a numpy array with the parsed contents of the video.
+  - (cap, frame_count, width, height): The `cv2.VideoCapture`, the number
+    of frames, and the width and height that frames are resized to.
   """
 
   # Read video
@@ -30,46 +40,139 @@ def _raw_numpy_array(video_file, nframes=None):
   min_dimension = 256.0
 
   # Determine scaling factors of width and height
-  assert min(w, h) > 0, 'Cannot resize {} with W={}, H={}'.format(video_file, w, h)
+  if not min(w, h) > 0:
+    cap.release()
+    raise ValueError('Cannot decode {} (W={}, H={})'.format(video_file, w, h))
   scale = min_dimension / min(w, h)
-  w = int(w * scale)
-  h = int(h * scale)
+  return cap, frame_count, int(w * scale), int(h * scale)
+
+
+def _center_window(frame_count, nframes):
+  """
+  Returns the (first, last) frame indices of the center window of `nframes`
+  frames in a video with `frame_count` frames. If the video is not longer
+  than `nframes`, the window spans the whole video.
+  """
+
+  if nframes is None or nframes >= frame_count:
+    return 0, frame_count
+
+  fc = frame_count
+  return int(fc/2) - int(nframes/2), int(fc/2) + int(nframes/2)
+
+
+SAMPLINGS = ('center', 'stride', 'uniform')
+
+
+def _sample_indices(frame_count, nframes, sampling='center', frame_step=2):
+  """
+  Returns the increasing indices of the frames to load from a video with
+  `frame_count` frames, depending on `sampling`:
+  - 'center': the center window of `nframes` consecutive frames
+  - 'stride': `nframes` frames, `frame_step` frames apart, centered in
+    the video, so a window covers `frame_step` times more motion
+  - 'uniform': `nframes` frames evenly spread over the whole video
+
+  Fewer than `nframes` indices are returned if the video is too short.
+  """
+
+  if sampling == 'center':
+    return np.arange(*_center_window(frame_count, nframes))
+
+  if sampling == 'stride':
+    assert frame_step > 0, 'Frame step must be positive'
+    if nframes is None:
+      return np.arange(0, frame_count, frame_step)
+    span = (nframes - 1) * frame_step + 1
+    first = max(int(frame_count/2) - int(span/2), 0)
+    return np.arange(first, frame_count, frame_step)[:nframes]
+
+  if sampling == 'uniform':
+    if nframes is None or nframes >= frame_count:
+      return np.arange(frame_count)
+    # Frames are at least 1 apart, so rounding never repeats a frame
+    return np.linspace(0, frame_count - 1, nframes).round().astype(np.int64)
+
+  raise ValueError('Unknown sampling %s' % sampling)
+
+
+def _stream_numpy_array(video_file, size, nframes=None, sampling='center', frame_step=2,
+                        timings=None):
+  """
+  Loads a video from the given file, but only decodes the `nframes`
+  frames chosen by `sampling` (see `_sample_indices`), and crops each
+  frame to a square of `size` as soon as it is decoded.
+  Frames in between are skipped with `cap.grab()`, which does not convert
+  them to images. Peak memory is proportional to `nframes * size * size`
+  rather than to the length and resolution of the whole video.
+
+  If a dictionary `timings` is given, the seconds spent on decoding and
+  on resizing and cropping are added to its `decode` and `resize` entries.
+
+  Returns:
+  - (buf, indices): A uint8 numpy array of shape (1, nframes, size, size, 3),
+    and the index in the video of each frame of the array.
+  """
 
-  buf = np.zeros((1, frame_count, h, w, 3), np.dtype('float32'))
+  start = time.time()
+  cap, frame_count, w, h = _open_video(video_file)
+  (h1, h2), (w1, w2) = _crop_bounds((w, h), size)
+
+  indices = _sample_indices(frame_count, nframes, sampling=sampling, frame_step=frame_step)
+  pos = int(indices[0]) if len(indices) else 0
+  if pos > 0 and not cap.set(cv2.CAP_PROP_POS_FRAMES, pos):
+    # Seeking is not supported by every backend, so skip frames instead
+    for _ in range(pos):
+      cap.grab()
+
+  buf = np.zeros((1, len(indices), h2 - h1, w2 - w1, 3), np.dtype('uint8'))
   fc, flag = 0, True
 
-  while fc < frame_count and flag:
-      flag, image = cap.read()
+  while fc < len(indices) and flag:
+      while pos < indices[fc] and flag:
+          flag = cap.grab()
+          pos += 1
 
+      flag = flag and cap.grab()
+      pos += 1
       if flag:
+          flag, image = cap.retrieve()
+
+      add_time(timings, 'decode', start)
+
+      if flag:
+          start = time.time()
           image = cv2.resize(image, (w, h))
-          buf[0, fc] = image
+          buf[0, fc] = image[h1:h2, w1:w2]
+          add_time(timings, 'resize', start)
 
+      start = time.time()
       fc += 1
 
   cap.release()
 
-  if nframes is not None:
-    if nframes < frame_count:
-      fc = frame_count
-      t1, t2 = int(fc/2) - int(nframes/2), int(fc/2) + int(nframes/2)
-      buf = buf[:, t1:t2, :, :, :]
-    elif nframes > frame_count:
-      buf = np.resize(buf, (1, nframes, h, w, 3))
+  # Short videos are padded by repeating them. The center window of an
+  # odd `nframes` is one frame short (see `_center_window`).
+  short = nframes is not None and (
+    nframes > frame_count if sampling == 'center' else nframes > len(indices))
+  if short:
+    buf = np.resize(buf, (1, nframes) + buf.shape[2:])
+    indices = np.resize(indices, nframes)
+  add_time(timings, 'decode', start)
 
-  return w, h, buf
+  return buf, indices
 
 
-def _crop_video(numpy_video, size, desired_size):
+def _crop_bounds(size, desired_size):
   """
-  Crop a video of the given size (WIDTH, HEIGHT) into a square of `desired_size`.
-  The video is represented as a numpy array. This func is for internal usage.
+  Returns the ((h1, h2), (w1, w2)) pixel bounds of a square center crop
+  of `desired_size` from a frame of the given size (WIDTH, HEIGHT).
   """
 
   w, h = size
   h1, h2 = int(h/2) - int(desired_size/2), int(h/2) + int(desired_size/2)
   w1, w2 = int(w/2) - int(desired_size/2), int(w/2) + int(desired_size/2)
-  return numpy_video[:, :, h1:h2, w1:w2, :]
+  return (h1, h2), (w1, w2)
 
 
 def _visualize_numpy_video(vid):
@@ -87,26 +190,183 @@ def _visualize_numpy_video(vid):
   plt.show()
 
 
-def rgb_data(video_file, size, nframes=None):
+def _normalize_rgb(buf):
+  """Scales pixels of a float32 video buffer between -1 and 1, in place."""
+
+  np.divide(buf, 255.0, out=buf)
+  np.multiply(buf, 2, out=buf)
+  np.subtract(buf, 1, out=buf)
+  return buf
+
+
+def rgb_to_float(rgb):
+  """
+  Converts uint8 RGB data (see `rgb_data(..., as_uint8=True)`) to the
+  float32 values between -1 and 1 which are fed to the model. Arrays of
+  any other type are returned as they are, so this can be applied to
+  whatever is fed to `rgb_input`.
+  """
+
+  if rgb.dtype != np.uint8:
+    return rgb
+  return _normalize_rgb(rgb.astype('float32'))
+
+
+def _grayscale(buf, chunk_size=16):
+  """
+  Converts a uint8 or float32 video buffer of shape (1, nframes, h, w, 3)
+  to a float32 grayscale buffer of shape (1, nframes, h, w).
+
+  The weighted sum is computed in float64, `chunk_size` frames at a time,
+  so that the result matches the float64 conversion bit for bit once it
+  is rounded to float32 (which the optical flow algorithm does anyway)
+  without allocating a float64 buffer for the whole video.
+  """
+
+  weights = np.array([0.2989, 0.5870, 0.1140])
+  gray = np.empty(buf.shape[:-1], dtype='float32')
+
+  for i in range(0, buf.shape[1], chunk_size):
+    gray[0, i:i + chunk_size] = np.dot(buf[0, i:i + chunk_size], weights)
+
+  return gray
+
+
+def _pair_flow(gray, i):
+  """
+  Computes the optical flow from frame `i - 1` to frame `i` of a
+  grayscale video buffer.
+  """
+
+  prev, cur = gray[0, i - 1], gray[0, i]
+  return cv2.calcOpticalFlowFarneback(prev, cur, None, 0.5, 3, 15, 3, 5, 1.2, 0)
+
+
+class FlowCache(object):
+  """
+  A thread-safe LRU cache for the optical flow of frame pairs, bounded by
+  the total size of the cached arrays (`max_bytes`). Passing the same
+  cache to `flow_data`, `rgb_flow_data` or `iter_windows` means that flow
+  is only computed for frame pairs which have not been seen before, e.g.
+  when windows overlap or a video is cropped or evaluated repeatedly.
+  """
+
+  def __init__(self, max_bytes=512 * 1024 * 1024):
+    self.max_bytes = max_bytes
+    self.num_bytes = 0
+    self.hits = 0
+    self.misses = 0
+    self._entries = collections.OrderedDict()
+    self._lock = threading.Lock()
+
+  def get(self, key):
+    with self._lock:
+      value = self._entries.get(key)
+      if value is None:
+        self.misses += 1
+      else:
+        self.hits += 1
+        self._entries.move_to_end(key)
+      return value
+
+  def put(self, key, value):
+    if value.nbytes > self.max_bytes:
+      return
+
+    with self._lock:
+      if key in self._entries:
+        self.num_bytes -= self._entries.pop(key).nbytes
+      self._entries[key] = value
+      self.num_bytes += value.nbytes
+
+      while self.num_bytes > self.max_bytes:
+        _, evicted = self._entries.popitem(last=False)
+        self.num_bytes -= evicted.nbytes
+
+  def __len__(self):
+    return len(self._entries)
+
+
+def _frame_ids(video_file, size, indices):
+  """
+  Returns a key for each frame index of a video, which identifies the
+  content of the frame after it is cropped to `size` (see `FlowCache`).
+  """
+
+  stat = os.stat(video_file)
+  video_id = (os.path.abspath(video_file), stat.st_mtime_ns, stat.st_size, size)
+  return [video_id + (int(i), ) for i in indices]
+
+
+def _optical_flow(gray, num_workers=None, flow_cache=None, frame_ids=None):
+  """
+  Computes the optical flow between consecutive frames of a grayscale
+  video buffer of shape (1, nframes, h, w). The first frame has no flow.
+
+  Frame pairs are independent of each other, so they are processed on a
+  pool of `num_workers` threads (OpenCV releases the GIL). By default one
+  thread per CPU is used; `num_workers=1` computes the flow serially.
+  The result does not depend on the number of workers.
+
+  If a `FlowCache` is given, `frame_ids` must contain a key for each
+  frame, and the flow of a frame pair is looked up by their keys.
+  """
+
+  num_frames, h, w = gray.shape[1:4]
+  flow = np.zeros((1, num_frames, h, w, 2), dtype='float32')
+
+  if num_workers is None:
+    num_workers = os.cpu_count() or 1
+
+  def _compute(i):
+    if flow_cache is None:
+      flow[0, i] = _pair_flow(gray, i)
+      return
+
+    key = (frame_ids[i - 1], frame_ids[i])
+    cur_flow = flow_cache.get(key)
+    if cur_flow is None:
+      cur_flow = _pair_flow(gray, i)
+      flow_cache.put(key, cur_flow)
+    flow[0, i] = cur_flow
+
+  # Apply optical flow algorithm
+  if num_workers <= 1 or num_frames <= 2:
+    for i in range(1, num_frames):
+      _compute(i)
+  else:
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+      # Consume the results so that exceptions are raised here
+      list(executor.map(_compute, range(1, num_frames)))
+
+  # Truncate values to [-20, 20] and scale from [-1, 1]
+  np.clip(flow, -20, 20, out=flow)
+  flow /= 20
+  return flow
+
+
+def rgb_data(video_file, size, nframes=None, sampling='center', frame_step=2, as_uint8=False):
   """
   Loads a numpy array of shape (1, nframes, size, size, 3) from a video file.
   Values contained in the array are based on RGB values of each frame in the video.
 
   Parameter `size` should be an int (pixels) for a square cropping of the video.
   Omitting the parameter `nframes` will preserve the original # frames in the video.
+  Parameter `sampling` is one of `SAMPLINGS` and chooses which frames are
+  loaded (see `_sample_indices`); 'stride' takes every `frame_step`-th frame.
+  With `as_uint8`, the pixels are returned as they are decoded, which takes
+  4x less memory; `rgb_to_float` converts them to the values fed to the model.
   """
 
-  # Load video into numpy array
-  w, h, buf = _raw_numpy_array(video_file, nframes=nframes)
-
-  # Scale pixels between -1 and 1
-  buf[0, :] = ((buf[0, :] / 255.0) * 2) - 1
+  # Load the center crop of the video into a numpy array
+  buf, _ = _stream_numpy_array(video_file, size, nframes=nframes,
+                               sampling=sampling, frame_step=frame_step)
 
-  # Select center crop from the video
-  return _crop_video(buf, (w, h), size)
+  return buf if as_uint8 else rgb_to_float(buf)
 
 
-def flow_data(video_file, size, nframes=None):
+def flow_data(video_file, size, nframes=None, num_workers=None, flow_cache=None,
+              sampling='center', frame_step=2):
   """
   Loads a numpy array of shape (1, nframes, size, size, 2) from a video file.
   Values contained in the array are based on optical flow of the video.
@@ -114,27 +374,146 @@ def flow_data(video_file, size, nframes=None):
 
   Parameter `size` should be an integer (pixels) for a square cropping of the video.
   Omitting the parameter `nframes` will preserve the original # frames in the video.
+  Parameter `num_workers` is the number of threads computing optical flow
+  (defaults to the number of CPUs). Parameter `flow_cache` is an optional
+  `FlowCache` for reusing the flow of frame pairs computed before.
+  Parameters `sampling` and `frame_step` are the same as for `rgb_data`;
+  flow is computed between consecutive sampled frames.
   """
 
-  # Load video into numpy array, and crop the video
-  w, h, buf = _raw_numpy_array(video_file, nframes=nframes)
-  buf = _crop_video(buf, (w, h), size)
+  # Load the center crop of the video into a numpy array
+  buf, indices = _stream_numpy_array(video_file, size, nframes=nframes,
+                                     sampling=sampling, frame_step=frame_step)
+  frame_ids = _frame_ids(video_file, size, indices) if flow_cache is not None else None
 
-  num_frames = buf.shape[1]
-  flow = np.zeros((1, num_frames, size, size, 2), dtype='float32')
+  return _optical_flow(_grayscale(buf), num_workers=num_workers,
+                       flow_cache=flow_cache, frame_ids=frame_ids)
 
-  # Convert to grayscale
-  buf = np.dot(buf, np.array([0.2989, 0.5870, 0.1140]))
 
-  # Apply optical flow algorithm
-  for i in range(1, num_frames):
-      prev, cur = buf[0, i - 1], buf[0, i]
-      cur_flow = cv2.calcOpticalFlowFarneback(prev, cur, None, 0.5, 3, 15, 3, 5, 1.2, 0)
+def add_time(timings, name, start):
+  """Adds the time since `start` to `timings[name]`, unless `timings` is None."""
 
-      # Truncate values to [-20, 20] and scale from [-1, 1]
-      cur_flow[cur_flow < -20] = -20
-      cur_flow[cur_flow > 20] = 20
-      cur_flow /= 20
-      flow[0, i] = cur_flow
+  if timings is not None:
+    timings[name] = timings.get(name, 0.0) + time.time() - start
 
-  return flow
+
+def rgb_flow_data(video_file, size, nframes=None, num_workers=None, flow_cache=None,
+                  timings=None, sampling='center', frame_step=2, as_uint8=False):
+  """
+  Loads both the RGB data and the optical flow data of a video file,
+  decoding the video only once. Equivalent to calling `rgb_data` and
+  `flow_data` with the same arguments, where `num_workers` is the
+  number of threads computing optical flow, `flow_cache` is an
+  optional `FlowCache`, `sampling` and `frame_step` choose the
+  frames that are loaded, and `as_uint8` keeps RGB as uint8 pixels.
+
+  If a dictionary `timings` is given, the seconds spent on decoding,
+  resizing and cropping, grayscale conversion, optical flow and RGB are
+  added to its `decode`, `resize`, `grayscale`, `flow_prep` and
+  `rgb_prep` entries.
+
+  Returns:
+  - (rgb, flow): numpy arrays of shape (1, nframes, size, size, 3)
+    and (1, nframes, size, size, 2) respectively. Flow is always float32.
+  """
+
+  # Load the center crop of the video into a numpy array
+  buf, indices = _stream_numpy_array(video_file, size, nframes=nframes,
+                                     sampling=sampling, frame_step=frame_step, timings=timings)
+  start = time.time()
+  frame_ids = _frame_ids(video_file, size, indices) if flow_cache is not None else None
+  add_time(timings, 'decode', start)
+
+  start = time.time()
+  gray = _grayscale(buf)
+  add_time(timings, 'grayscale', start)
+
+  start = time.time()
+  flow = _optical_flow(gray, num_workers=num_workers, flow_cache=flow_cache, frame_ids=frame_ids)
+  add_time(timings, 'flow_prep', start)
+
+  start = time.time()
+  rgb = buf if as_uint8 else rgb_to_float(buf)
+  add_time(timings, 'rgb_prep', start)
+
+  return rgb, flow
+
+
+def video_fps(video_file):
+  """Returns the number of frames per second of a video file."""
+
+  cap = cv2.VideoCapture(video_file)
+  fps = cap.get(cv2.CAP_PROP_FPS)
+  cap.release()
+  return fps
+
+
+def iter_windows(video_file, size, nframes, stride, num_workers=None, flow_cache=None,
+                 frame_step=1):
+  """
+  Streams a video through overlapping windows of `nframes` frames, where
+  consecutive windows start `stride` frames apart. Each frame is decoded
+  and cropped only once, and at most `nframes` decoded frames are kept in
+  memory. With a `frame_step` above 1, only every `frame_step`-th frame
+  is decoded (like 'stride' sampling) and `nframes` and `stride` count
+  these frames only. If the last window does not end on the last frame, one more
+  window is aligned to the end of the video, so every frame is covered.
+  Videos shorter than `nframes` yield a single window, padded like
+  `rgb_data` does. Overlapping windows reuse the flow of shared frame
+  pairs through `flow_cache` (a new `FlowCache` by default).
+
+  Yields:
+  - (first, last, rgb, flow): The frame indices [first, last) of the
+    window in the video, and its RGB and optical flow data with the same
+    shapes as returned by `rgb_flow_data(video_file, size, nframes)`.
+  """
+
+  assert 0 < stride, 'Stride must be positive'
+  assert 0 < frame_step, 'Frame step must be positive'
+
+  cap, frame_count, w, h = _open_video(video_file)
+  (h1, h2), (w1, w2) = _crop_bounds((w, h), size)
+
+  if flow_cache is None:
+    # Consecutive windows share at most `nframes - stride` frame pairs
+    pair_bytes = (h2 - h1) * (w2 - w1) * 2 * np.dtype('float32').itemsize
+    flow_cache = FlowCache(max_bytes=nframes * pair_bytes)
+
+  def _window(frames, first):
+    buf = np.stack(frames)[np.newaxis]
+    indices = np.arange(first, first + len(frames)) * frame_step
+    if buf.shape[1] < nframes:
+      buf = np.resize(buf, (1, nframes) + buf.shape[2:])
+      indices = np.resize(indices, nframes)
+    frame_ids = _frame_ids(video_file, size, indices)
+    flow = _optical_flow(_grayscale(buf), num_workers=num_workers,
+                         flow_cache=flow_cache, frame_ids=frame_ids)
+    rgb = rgb_to_float(buf)
+    last = (first + len(frames) - 1) * frame_step + 1
+    return first * frame_step, last, rgb, flow
+
+  frames = collections.deque(maxlen=nframes)
+  fc, last_end = 0, 0
+
+  try:
+    while True:
+      # Skip the frames in between without converting them to images
+      flag = all(cap.grab() for _ in range(frame_step - 1)) if fc > 0 else True
+      flag = flag and cap.grab()
+      if flag:
+        flag, image = cap.retrieve()
+      if not flag:
+        break
+
+      image = cv2.resize(image, (w, h))
+      frames.append(image[h1:h2, w1:w2])
+      fc += 1
+
+      if fc >= nframes and (fc - nframes) % stride == 0:
+        last_end = fc
+        yield _window(frames, fc - nframes)
+  finally:
+    cap.release()
+
+  if frames and last_end < fc:
+    yield _window(frames, fc - len(frames))
@@ -0,0 +1,150 @@
+"""
+Profiles sampled training steps of the two-stream model and attributes
+their cost to the endpoints of `i3d.InceptionI3d`.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+import json
+import collections
+
+import tensorflow as tf
+from tensorflow.python.client import timeline
+
+from i3d import InceptionI3d
+
+
+# The trainable head of `build_graph` replaces the `Logits` endpoint
+_HEAD_SCOPES = ('Conv3d_0c_1x1', 'SpatialSqueeze')
+_OTHER = 'other'
+
+
+def endpoint_of(op_name):
+  """
+  Returns the name of the endpoint in `InceptionI3d.VALID_ENDPOINTS` which
+  an op (or its gradient) belongs to, or 'other' for the inputs, loss,
+  optimizer and summary ops.
+  """
+
+  for scope in op_name.split(':')[0].split('/'):
+    if scope in InceptionI3d.VALID_ENDPOINTS:
+      return scope
+    if scope in _HEAD_SCOPES:
+      return 'Logits'
+  return _OTHER
+
+
+def _empty_costs():
+  return collections.OrderedDict(
+    (name, {'flops': 0, 'micros': 0, 'bytes': 0})
+    for name in InceptionI3d.VALID_ENDPOINTS + (_OTHER, ))
+
+
+class Profiler(object):
+  """
+  Captures the `RunMetadata` of every `every`-th step. For each profiled
+  step, the metadata is added to the summary writer (TensorBoard shows it
+  on the graph tab) and a Chrome trace is written to `log_dir`, which can
+  be opened in chrome://tracing. The FLOPs, time and output memory of all
+  ops are summed per endpoint over the profiled steps.
+
+  Example:
+    profiler = Profiler('summaries/profile', every=100)
+    options, run_metadata = profiler.run_args(step)
+    sess.run(ops, feed_dict, options=options, run_metadata=run_metadata)
+    profiler.add(step, run_metadata, writer)
+  """
+
+  def __init__(self, log_dir, every=100, graph=None):
+    self.log_dir = log_dir
+    self.every = every
+    self.num_steps = 0
+    self._graph = graph or tf.get_default_graph()
+    self._costs = _empty_costs()
+
+    if not os.path.exists(log_dir):
+      os.makedirs(log_dir)
+
+  def should_profile(self, step):
+    return self.every is not None and step % self.every == 0
+
+  def run_args(self, step):
+    """
+    Returns the (options, run_metadata) to pass to `sess.run`, which are
+    both None if `step` is not profiled.
+    """
+
+    if not self.should_profile(step):
+      return None, None
+    options = tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE)
+    return options, tf.RunMetadata()
+
+  def add(self, step, run_metadata, writer=None):
+    """Records the cost of a profiled step. Does nothing if `run_metadata` is None."""
+
+    if run_metadata is None:
+      return
+
+    trace = timeline.Timeline(run_metadata.step_stats)
+    trace_path = os.path.join(self.log_dir, 'timeline_step_%d.json' % step)
+    with open(trace_path, 'w') as f:
+      f.write(trace.generate_chrome_trace_format())
+
+    if writer is not None:
+      writer.add_run_metadata(run_metadata, 'step_%d' % step, step)
+
+    for device in run_metadata.step_stats.dev_stats:
+      for node in device.node_stats:
+        costs = self._costs[endpoint_of(node.node_name)]
+        costs['micros'] += node.all_end_rel_micros
+        costs['bytes'] += sum(output.tensor_description.allocation_description.allocated_bytes
+                              for output in node.output)
+
+    # Shapes come from the run metadata, so this also works with a variable batch size
+    options = tf.profiler.ProfileOptionBuilder(
+      tf.profiler.ProfileOptionBuilder.float_operation()).with_empty_output().build()
+    nodes = [tf.profiler.profile(self._graph, run_meta=run_metadata, cmd='scope', options=options)]
+    while nodes:
+      node = nodes.pop()
+      self._costs[endpoint_of(node.name)]['flops'] += node.float_ops
+      nodes.extend(node.children)
+
+    self.num_steps += 1
+
+  def report(self):
+    """
+    Returns a dictionary of endpoint -> {flops, micros, bytes}, averaged
+    over the profiled steps, in the order of `VALID_ENDPOINTS`. Endpoints
+    which are not part of the graph are left out.
+    """
+
+    num_steps = max(self.num_steps, 1)
+    return collections.OrderedDict(
+      (name, {key: value / num_steps for key, value in costs.items()})
+      for name, costs in self._costs.items() if any(costs.values()))
+
+  def table(self):
+    """Returns a printable table of `report`, with each endpoint's share of the total."""
+
+    report = self.report()
+    total_flops = sum(c['flops'] for c in report.values()) or 1
+    total_micros = sum(c['micros'] for c in report.values()) or 1
+
+    lines = ['%-16s  %10s  %6s  %10s  %6s  %10s' % (
+      'endpoint', 'GFLOPs', 'share', 'time (ms)', 'share', 'out (MB)')]
+    for name, c in report.items():
+      lines.append('%-16s  %10.2f  %5.1f%%  %10.1f  %5.1f%%  %10.1f' % (
+        name, c['flops'] / 1e9, 100 * c['flops'] / total_flops,
+        c['micros'] / 1e3, 100 * c['micros'] / total_micros, c['bytes'] / 2**20
+      ))
+    return '\n'.join(lines)
+
+  def save(self, path=None):
+    """Writes `report` as JSON, by default to `log_dir/endpoint_costs.json`."""
+
+    path = path or os.path.join(self.log_dir, 'endpoint_costs.json')
+    with open(path, 'w') as f:
+      json.dump({'num_steps': self.num_steps, 'endpoints': self.report()}, f, indent=2)
+    return path
@@ -0,0 +1,229 @@
+#!/opt/anaconda3/bin/python
+
+"""
+A local HTTP server which keeps the two-stream model loaded and
+classifies videos on request. Concurrent requests are pre-processed in
+parallel and scored together in dynamically formed batches.
+
+Classify a video on disk:
+  curl -X POST -H 'Content-Type: application/json' \
+       -d '{"path": "videos/push-up_correct_1234.mov"}' localhost:8000/classify
+
+Classify the raw bytes of a video:
+  curl -X POST -H 'Content-Type: application/octet-stream' \
+       --data-binary @video.mov localhost:8000/classify
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+
+import os
+import json
+import time
+import queue
+import argparse
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import tensorflow as tf
+
+from build_graph import FINAL_ENDPOINT, NUM_FRAMES, IMAGE_SIZE
+from classifier import Classifier, softmax
+from process_video import rgb_flow_data, SAMPLINGS
+
+
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
+
+
+class _Request(object):
+  def __init__(self, rgb, flow):
+    self.rgb = rgb
+    self.flow = flow
+    self.logits = None
+    self.error = None
+    self.done = threading.Event()
+
+
+class DynamicBatcher(object):
+  """
+  Scores pre-processed videos with a `Classifier` on a single thread.
+  Requests which arrive while a batch is running are queued, and the
+  next batch takes up to `max_batch_size` of them, waiting at most
+  `max_wait` seconds for the batch to fill up. Queued RGB is kept as
+  uint8 and only converted to float when its batch runs.
+  """
+
+  def __init__(self, classifier, max_batch_size=8, max_wait=0.01):
+    self._classifier = classifier
+    self._max_batch_size = max_batch_size
+    self._max_wait = max_wait
+    self._queue = queue.Queue()
+    self._thread = threading.Thread(target=self._run, daemon=True)
+    self._thread.start()
+
+  def predict(self, rgb, flow):
+    """Blocks until the logits for a single pre-processed video are computed."""
+
+    request = _Request(rgb, flow)
+    self._queue.put(request)
+    request.done.wait()
+    if request.error is not None:
+      raise request.error
+    return request.logits
+
+  def _next_batch(self):
+    batch = [self._queue.get()]
+    # A batch waits at most max_wait in total, however many requests it takes
+    deadline = time.monotonic() + self._max_wait
+    while len(batch) < self._max_batch_size:
+      remaining = deadline - time.monotonic()
+      if remaining <= 0:
+        break
+      try:
+        batch.append(self._queue.get(timeout=remaining))
+      except queue.Empty:
+        break
+    return batch
+
+  def _run(self):
+    while True:
+      batch = self._next_batch()
+      try:
+        rgb = np.concatenate([r.rgb for r in batch], axis=0)
+        flow = np.concatenate([r.flow for r in batch], axis=0)
+        logits = self._classifier.predict(rgb, flow)
+        for i, request in enumerate(batch):
+          request.logits = logits[i]
+      except Exception as e:
+        for request in batch:
+          request.error = e
+      finally:
+        for request in batch:
+          request.done.set()
+
+
+def _content_length(headers):
+  """Returns the length of the request body, or raises ValueError if it is invalid."""
+
+  value = headers.get('Content-Length', '0')
+  try:
+    length = int(value)
+  except ValueError:
+    length = -1
+  if length < 0:
+    raise ValueError('Invalid Content-Length %s' % value)
+  return length
+
+
+def _make_handler(batcher, classifier):
+  classes = classifier.classes
+
+  class Handler(BaseHTTPRequestHandler):
+
+    def _send_json(self, status, body):
+      data = json.dumps(body).encode('utf-8')
+      self.send_response(status)
+      self.send_header('Content-Type', 'application/json')
+      self.send_header('Content-Length', str(len(data)))
+      self.end_headers()
+      self.wfile.write(data)
+
+    def _preprocess(self, video_file):
+      return rgb_flow_data(video_file, classifier.image_size, nframes=classifier.num_frames,
+                           sampling=classifier.sampling, frame_step=classifier.frame_step,
+                           as_uint8=True)
+
+    def _classify(self, rgb, flow):
+      probs = softmax(batcher.predict(rgb, flow))
+      return {
+        'label': classes[probs.argmax()],
+        'scores': dict(zip(classes, probs.tolist()))
+      }
+
+    def do_POST(self):
+      if self.path != '/classify':
+        return self._send_json(404, {'error': 'Unknown path %s' % self.path})
+
+      try:
+        body = self.rfile.read(_content_length(self.headers))
+        if self.headers.get('Content-Type', '').startswith('application/json'):
+          try:
+            request = json.loads(body.decode('utf-8'))
+          except ValueError as e:
+            return self._send_json(400, {'error': 'Invalid JSON: %s' % e})
+          if not isinstance(request, dict) or not isinstance(request.get('path'), str):
+            return self._send_json(400, {'error': 'Expected a JSON object with a "path"'})
+          video_file = request['path']
+          if not os.path.isfile(video_file):
+            return self._send_json(400, {'error': 'No such file %s' % video_file})
+          rgb, flow = self._preprocess(video_file)
+        else:
+          # OpenCV can only decode videos from files
+          with tempfile.NamedTemporaryFile(suffix='.mov') as f:
+            f.write(body)
+            f.flush()
+            rgb, flow = self._preprocess(f.name)
+      except ValueError as e:
+        # The request or the video could not be decoded
+        return self._send_json(400, {'error': str(e)})
+      except Exception as e:
+        return self._send_json(500, {'error': str(e)})
+
+      try:
+        result = self._classify(rgb, flow)
+      except Exception as e:
+        return self._send_json(500, {'error': str(e)})
+
+      self._send_json(200, result)
+
+    def log_message(self, format, *args):
+      tf.logging.info('%s - %s' % (self.address_string(), format % args))
+
+  return Handler
+
+
+def serve(host='127.0.0.1', port=8000, max_batch_size=8, max_wait=0.01,
+          final_endpoint=FINAL_ENDPOINT, num_frames=NUM_FRAMES, image_size=IMAGE_SIZE,
+          sampling='center', frame_step=2):
+  """Loads the model and serves classification requests until interrupted."""
+
+  tf.logging.set_verbosity(tf.logging.INFO)
+
+  classifier = Classifier(final_endpoint=final_endpoint, num_frames=num_frames,
+                          image_size=image_size, sampling=sampling, frame_step=frame_step)
+  batcher = DynamicBatcher(classifier, max_batch_size=max_batch_size, max_wait=max_wait)
+  server = ThreadingHTTPServer((host, port), _make_handler(batcher, classifier))
+
+  tf.logging.info('Serving on http://%s:%d/classify' % (host, port))
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.server_close()
+    classifier.close()
+
+
+def _parse_args():
+  parser = argparse.ArgumentParser(description='Serve the video classifier over HTTP.')
+  parser.add_argument('--host', default='127.0.0.1')
+  parser.add_argument('--port', type=int, default=8000)
+  parser.add_argument('--max-batch-size', type=int, default=8)
+  parser.add_argument('--max-wait', type=float, default=0.01,
+                      help='seconds to wait for a batch to fill up')
+  parser.add_argument('--final-endpoint', default=FINAL_ENDPOINT)
+  parser.add_argument('--num-frames', type=int, default=NUM_FRAMES)
+  parser.add_argument('--image-size', type=int, default=IMAGE_SIZE)
+  parser.add_argument('--sampling', choices=SAMPLINGS, default='center')
+  parser.add_argument('--frame-step', type=int, default=2)
+  return parser.parse_args()
+
+
+if __name__ == '__main__':
+  args = _parse_args()
+  serve(host=args.host, port=args.port,
+        max_batch_size=args.max_batch_size, max_wait=args.max_wait,
+        final_endpoint=args.final_endpoint, num_frames=args.num_frames,
+        image_size=args.image_size, sampling=args.sampling, frame_step=args.frame_step)
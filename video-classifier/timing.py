@@ -0,0 +1,84 @@
+"""
+Measures where the wall-clock time of a training run goes, stage by stage.
+"""
+
+import time
+import threading
+import contextlib
+import collections
+
+import tensorflow as tf
+
+
+class StageTimer(object):
+  """
+  Accumulates the time spent in named stages (e.g. `decode`, `sess_run`)
+  for the current step, and the totals over all steps. Stages may be
+  recorded from several threads; stages which run in the background (e.g.
+  pre-processing in a `Prefetcher`) overlap with the others, so their
+  share of the total can add up to more than the wall-clock time.
+
+  Example:
+    timer = StageTimer()
+    with timer.stage('sess_run'):
+      sess.run(...)
+    timer.end_step(writer, step)
+  """
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._step = collections.OrderedDict()
+    self._totals = collections.OrderedDict()
+    self._num_steps = 0
+
+  @contextlib.contextmanager
+  def stage(self, name):
+    start = time.time()
+    try:
+      yield
+    finally:
+      self.add(name, time.time() - start)
+
+  def add(self, name, seconds):
+    with self._lock:
+      self._step[name] = self._step.get(name, 0.0) + seconds
+
+  def add_all(self, timings):
+    for name, seconds in timings.items():
+      self.add(name, seconds)
+
+  def end_step(self, writer=None, step=None):
+    """
+    Finishes the current step, and writes its timings as TensorBoard
+    scalars under `timing/` if a `tf.summary.FileWriter` is given.
+    """
+
+    with self._lock:
+      timings, self._step = self._step, collections.OrderedDict()
+      for name, seconds in timings.items():
+        self._totals[name] = self._totals.get(name, 0.0) + seconds
+      self._num_steps += 1
+
+    if writer is not None and timings:
+      values = [tf.Summary.Value(tag='timing/' + name, simple_value=seconds)
+                for name, seconds in timings.items()]
+      writer.add_summary(tf.Summary(value=values), step)
+
+    return timings
+
+  def table(self):
+    """Returns a printable table of the total and per-step time of each stage."""
+
+    with self._lock:
+      totals = list(self._totals.items())
+      num_steps = max(self._num_steps, 1)
+
+    overall = sum(seconds for _, seconds in totals) or 1.0
+    width = max([len(name) for name, _ in totals] + [5])
+
+    lines = ['%s  %10s  %10s  %6s' % ('stage'.ljust(width), 'total (s)', 'step (ms)', 'share')]
+    for name, seconds in sorted(totals, key=lambda x: -x[1]):
+      lines.append('%s  %10.2f  %10.1f  %5.1f%%' % (
+        name.ljust(width), seconds, 1000 * seconds / num_steps, 100 * seconds / overall
+      ))
+    return '\n'.join(lines)
@@ -5,27 +5,37 @@ from __future__ import absolute_import
 from __future__ import division
 
 import os
+import time
 import random
+import threading
 import numpy as np
 import tensorflow as tf
 
-from build_graph import build_graph, NUM_FRAMES, IMAGE_SIZE
+from build_graph import build_graph, build_feature_graph, build_head_graph, config_name
+from build_graph import FINAL_ENDPOINT, NUM_FRAMES, IMAGE_SIZE, HEAD_VARIABLES
+from build_graph import CHECKPOINT_PATHS
+from evaluate import evaluate, format_metrics
 from load_dataset import load_exercise_dataset
-from process_video import rgb_data, flow_data
+from persistence import AsyncSaver, MetricsLog
+from prefetch import Prefetcher
+from profiling import Profiler
+from timing import StageTimer
+from video_cache import cached_rgb_flow_data, cached_features
+from process_video import add_time, rgb_flow_data, rgb_to_float
 
 
 _CHECK_EVERY = 20
+_TIMING_EVERY = 100
 
 _VIDEO_DIR = 'videos'
 _LABEL_MAP_PATH = 'data/exercises_label_map.txt'
+_CACHE_DIR = 'data/cache'
+_PROFILE_DIR = 'summaries/profile'
 
-_CHECKPOINT_PATHS = {
-  'rgb_imagenet': 'data/checkpoints/rgb_imagenet/model.ckpt',
-  'flow_imagenet': 'data/checkpoints/flow_imagenet/model.ckpt',
-  'training': 'data/checkpoints/training/model.ckpt'
-}
+_STATS_DIR = 'data/stats'
 
-_STATS = {
+# Statistics saved as whole arrays by earlier versions, imported into the log once
+_LEGACY_STATS = {
   'train_acc': 'data/stats/train_acc.npy',
   'val_acc': 'data/stats/val_acc.npy',
   'loss': 'data/stats/loss.npy'
@@ -34,53 +44,212 @@ _STATS = {
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
 
 
-def train(num_epochs, beta, lr, evaluate_test_dset=False):
+def _batches(dset, batch_size):
+  """Splits a list of (x, y) samples into batches of `batch_size` samples."""
+
+  return [dset[i:i + batch_size] for i in range(0, len(dset), batch_size)]
+
+
+def build_training_graph(beta, head_only=False, **config):
+  """
+  Builds the graph for training, either the whole two-stream model, or
+  with `head_only`, the frozen backbone and the trainable head as two
+  separate parts (see `build_graph.build_feature_graph`).
+
+  Returns:
+  - (backbone, inputs, outputs, savers, summaries) where backbone is
+    the (inputs, features) of the frozen part with `head_only`, else
+    None, savers are the (rgb_saver, flow_saver, training_saver), and
+    the others are like in `build_graph.build_graph`.
+  """
+
+  if head_only:
+    backbone_inputs, backbone_features, backbone_savers = build_feature_graph(batch_size=None, **config)
+    inputs, outputs, training_saver, tf_summaries = build_head_graph(
+      beta=beta, batch_size=None, **config)
+    return ((backbone_inputs, backbone_features), inputs, outputs,
+            backbone_savers + (training_saver, ), tf_summaries)
+
+  inputs, outputs, savers, tf_summaries = build_graph(beta=beta, batch_size=None, **config)
+  return None, inputs, outputs, savers, tf_summaries
+
+
+def restore_checkpoints(sess, savers, training_checkpoint):
+  """Restores the pre-trained streams, and the training checkpoint if there is one."""
+
+  rgb_saver, flow_saver, training_saver = savers
+  rgb_saver.restore(sess, CHECKPOINT_PATHS['rgb_imagenet'])
+  tf.logging.info('RGB checkpoint restored')
+  flow_saver.restore(sess, CHECKPOINT_PATHS['flow_imagenet'])
+  tf.logging.info('Flow checkpoint restored')
+  try:
+    training_saver.restore(sess, training_checkpoint)
+    tf.logging.info('Training checkpoint restored')
+  except Exception as e:
+    pass
+
+
+def open_stats():
+  """Opens the log of training statistics, importing legacy statistics once."""
+
+  stats = MetricsLog(_STATS_DIR)
+  for name, legacy_path in _LEGACY_STATS.items():
+    if stats.count(name) == 0 and os.path.isfile(legacy_path):
+      stats.extend(name, np.load(legacy_path))
+      stats.flush()
+      tf.logging.info('Statistics %s imported from %s' % (name, legacy_path))
+  return stats
+
+
+def split_train_val(X_train_initial, y_train_initial, validation_cutoff):
+  """Re-samples the train and validation datasets, as lists of (x, y) samples."""
+
+  dset_size = X_train_initial.shape[0]
+  indices = random.sample(list(range(dset_size)), validation_cutoff)
+  mask = np.ones(dset_size, bool)
+  mask[indices] = 0
+  train_dset = list(zip(X_train_initial[mask], y_train_initial[mask]))
+  val_dset = list(zip(X_train_initial[indices], y_train_initial[indices]))
+  return train_dset, val_dset
+
+
+class InputPipeline(object):
+  """
+  Pre-processes videos into the inputs of the model: RGB (as uint8) and
+  flow, or with a `backbone` (see `build_training_graph`), the features
+  of its final endpoint computed in `sess`. Inputs are read from and
+  written to the cache in `cache_dir`, unless it is None.
+
+  With a `profiler` (see `profiling.Profiler`), every `profiler.every`-th
+  run of the backbone is profiled. Features which are read from the cache
+  are not computed, so they are not profiled either.
+  """
+
+  def __init__(self, sess, backbone=None, cache_dir=_CACHE_DIR, final_endpoint=FINAL_ENDPOINT,
+               num_frames=NUM_FRAMES, image_size=IMAGE_SIZE, sampling='center', frame_step=2,
+               profiler=None):
+    self.sess = sess
+    self.backbone = backbone
+    self.profiler = profiler
+    self._num_extracted = 0
+    self._lock = threading.Lock()
+    self.cache_dir = cache_dir
+    self.final_endpoint = final_endpoint
+    self.num_frames = num_frames
+    self.image_size = image_size
+    self.sampling = sampling
+    self.frame_step = frame_step
+
+  def _extract_features(self, rgb, flow):
+    backbone_inputs, backbone_features = self.backbone
+    feed_dict = dict(zip(backbone_inputs, (rgb_to_float(rgb), flow)))
+    if self.profiler is None:
+      return self.sess.run(backbone_features, feed_dict=feed_dict)
+
+    # Features are extracted on the threads of the prefetcher
+    with self._lock:
+      step = self._num_extracted
+      self._num_extracted += 1
+    options, run_metadata = self.profiler.run_args(step)
+    features = self.sess.run(backbone_features, feed_dict=feed_dict,
+                             options=options, run_metadata=run_metadata)
+    if run_metadata is not None:
+      with self._lock:
+        self.profiler.add(step, run_metadata)
+    return features
+
+  def preprocess(self, x_video, timings=None):
+    frame_args = dict(nframes=self.num_frames, sampling=self.sampling, frame_step=self.frame_step,
+                      timings=timings)
+
+    if self.cache_dir is None:
+      rgb, flow = rgb_flow_data(x_video, self.image_size, as_uint8=True, **frame_args)
+      if self.backbone is None:
+        return rgb, flow
+      start = time.time()
+      features = self._extract_features(rgb, flow)
+      add_time(timings, 'features', start)
+      return features
+    elif self.backbone is not None:
+      return cached_features(x_video, self.image_size, self._extract_features,
+                             cache_dir=self.cache_dir, endpoint=self.final_endpoint, **frame_args)
+    return cached_rgb_flow_data(x_video, self.image_size, cache_dir=self.cache_dir, **frame_args)
+
+  def preprocess_batch(self, batch):
+    """Returns the (rgb, flow, timings) of a batch of (x, y) samples."""
+
+    timings = {}
+    samples = [self.preprocess(x_video, timings=timings) for x_video, _ in batch]
+
+    start = time.time()
+    rgb = np.concatenate([rgb for rgb, _ in samples], axis=0)
+    flow = np.concatenate([flow for _, flow in samples], axis=0)
+    timings['batching'] = time.time() - start
+    return rgb, flow, timings
+
+
+def train(num_epochs, beta, lr, evaluate_test_dset=False, cache_dir=_CACHE_DIR,
+          prefetch_depth=2, batch_size=1, head_only=False, eval_batch_size=8,
+          profile_every=None, profile_dir=_PROFILE_DIR, final_endpoint=FINAL_ENDPOINT,
+          num_frames=NUM_FRAMES, image_size=IMAGE_SIZE, sampling='center', frame_step=2,
+          index_path=None):
+  """
+  Trains the logits layers of the two-stream model.
+
+  With `head_only`, the frozen part of the model is evaluated only once
+  per video and its `final_endpoint` features are cached in `cache_dir`.
+  Every training step then runs only the trainable head on cached features.
+
+  `final_endpoint`, `num_frames` and `image_size` configure a cheaper
+  model (see `build_graph.build_graph`). Other configurations than the
+  default one use their own training checkpoint. `sampling` and
+  `frame_step` choose the frames of each video that are used (see
+  `process_video.rgb_data`). Videos are listed from the dataset index in
+  `index_path` (see `load_dataset.DatasetIndex.open`).
+
+  With `profile_every`, every `profile_every`-th step is traced, and a
+  Chrome trace per traced step and the cost of each I3D endpoint are
+  written to `profile_dir` (see `profiling.Profiler`). With `head_only`,
+  training steps only run the head, so every `profile_every`-th run of
+  the backbone is profiled separately into `profile_dir/backbone`.
+  """
+
   tf.logging.set_verbosity(tf.logging.INFO)
   tf.reset_default_graph()
 
-  inputs, outputs, savers, tf_summaries = build_graph(beta=beta)
+  config = dict(final_endpoint=final_endpoint, num_frames=num_frames, image_size=image_size)
+  training_checkpoint = CHECKPOINT_PATHS['training'].format(config_name(**config))
+
+  backbone, inputs, outputs, savers, tf_summaries = build_training_graph(
+    beta, head_only=head_only, **config)
+
   learning_rate, rgb_input, flow_input, is_training, y = inputs
   scores, loss, loss_minimize = outputs
-  rgb_saver, flow_saver, training_saver = savers
 
   # Load the training and test data
-  X_train_initial, X_test, y_train_initial, y_test = load_exercise_dataset(_VIDEO_DIR, _LABEL_MAP_PATH)
+  X_train_initial, X_test, y_train_initial, y_test = load_exercise_dataset(
+    _VIDEO_DIR, _LABEL_MAP_PATH, index_path=index_path)
   X_train_initial, y_train_initial = np.array(X_train_initial), np.array(y_train_initial)
   dset_size = X_train_initial.shape[0]
   validation_cutoff = int(dset_size * 0.2)
   test_dset = list(zip(X_test, y_test))
+  classes = [x.strip() for x in open(_LABEL_MAP_PATH)]
 
   print('\ntrain_dset len={}; val_dset len={}; test_dset len={}\n'.format(
     dset_size - validation_cutoff, validation_cutoff, len(test_dset)
   ))
 
-  try:
-    train_accuracies = np.load(_STATS['train_acc']).tolist()
-    val_accuracies = np.load(_STATS['val_acc']).tolist()
-    losses = np.load(_STATS['loss']).tolist()
-    tf.logging.info('Statistics restored')
-  except:
-    train_accuracies, val_accuracies, losses = [], [], []
+  stats = open_stats()
 
 
-  def _check_acc(msg, dset, sess):
-    num_correct, num_samples = 0, 0
+  def _check_acc(dsets, pipeline):
+    results = evaluate(pipeline.sess, (rgb_input, flow_input), scores, dsets, pipeline.preprocess,
+                       batch_size=eval_batch_size, prefetch_depth=prefetch_depth,
+                       feed_dict={is_training: 0})
 
-    for x_video, y_class in dset:
-      feed_dict = {
-        rgb_input: rgb_data(x_video, IMAGE_SIZE, nframes=NUM_FRAMES),
-        flow_input: flow_data(x_video, IMAGE_SIZE, nframes=NUM_FRAMES),
-        is_training: 0
-      }
-
-      scores_np = sess.run(scores, feed_dict=feed_dict)
-      y_pred = scores_np.argmax(axis=1)
-      num_samples += 1
-      num_correct += (y_pred == y_class).sum()
-
-    acc = float(num_correct) / num_samples
-    print('%s: %d / %d correct (%.2f%%)' % (msg, num_correct, num_samples, 100 * acc))
-    return acc
+    for msg, metrics in results.items():
+      print(format_metrics(msg, metrics, classes=classes))
+    return {msg: metrics['accuracy'] for msg, metrics in results.items()}
 
 
   if not os.path.exists('summaries'):
@@ -96,71 +265,113 @@ def train(num_epochs, beta, lr, evaluate_test_dset=False):
     writer = tf.summary.FileWriter(path, sess.graph)
     sess.run(tf.global_variables_initializer())
 
-    rgb_saver.restore(sess, _CHECKPOINT_PATHS['rgb_imagenet'])
-    tf.logging.info('RGB checkpoint restored')
-    flow_saver.restore(sess, _CHECKPOINT_PATHS['flow_imagenet'])
-    tf.logging.info('Flow checkpoint restored')
-    try:
-      training_saver.restore(sess, _CHECKPOINT_PATHS['training'])
-      tf.logging.info('Training checkpoint restored')
-    except Exception as e:
-      pass
+    restore_checkpoints(sess, savers, training_checkpoint)
+
+    profiler = Profiler(profile_dir, every=profile_every) if profile_every else None
+    backbone_profiler = None
+    if profiler and head_only:
+      backbone_profiler = Profiler(os.path.join(profile_dir, 'backbone'), every=profile_every)
+
+    pipeline = InputPipeline(sess, backbone=backbone, cache_dir=cache_dir, sampling=sampling,
+                             frame_step=frame_step, profiler=backbone_profiler, **config)
 
     if evaluate_test_dset:
-      _ = _check_acc('Test', test_dset, sess)
+      _ = _check_acc({'Test': test_dset}, pipeline)
       exit()
 
     t = 0
+    timer = StageTimer()
+
+    # Checkpoints are written in the background, from a snapshot of the head variables
+    async_saver = AsyncSaver(tf.get_collection(HEAD_VARIABLES), sess)
 
-    for epoch in range(num_epochs):
-      print('Starting epoch %d' % epoch)
-
-      # Re-sample train and validation datasets for each epoch
-      nums = list(range(dset_size))
-      indices = random.sample(nums, validation_cutoff)
-      mask = np.ones(dset_size, np.bool)
-      mask[indices] = 0
-      X_train, y_train = X_train_initial[mask], y_train_initial[mask]
-      train_dset = list(zip(X_train, y_train))
-      X_val, y_val = X_train_initial[indices], y_train_initial[indices]
-      val_dset = list(zip(X_val, y_val))
-
-      if epoch != 0:
-        # Check training and validation accuracies, and save the model
-        save_path = training_saver.save(sess, _CHECKPOINT_PATHS['training'])
-        print('\nTraining model saved in path: %s' % save_path)
-
-        train_acc = _check_acc('Train', train_dset, sess)
-        val_acc = _check_acc('Val', val_dset, sess)
-
-        train_accuracies.append(train_acc)
-        val_accuracies.append(val_acc)
-
-        np.save(_STATS['train_acc'], np.array(train_accuracies))
-        np.save(_STATS['val_acc'], np.array(val_accuracies))
-        np.save(_STATS['loss'], np.array(losses))
-
-      for x_video, y_class in train_dset:
-        feed_dict = {
-          learning_rate: lr,
-          rgb_input: rgb_data(x_video, IMAGE_SIZE, nframes=NUM_FRAMES),
-          flow_input: flow_data(x_video, IMAGE_SIZE, nframes=NUM_FRAMES),
-          y: np.array([y_class]),
-          is_training: 1
-        }
-
-        if t % _CHECK_EVERY == 0:
-            ops = [loss, loss_minimize, tf_summaries]
-            loss_np, _, summary = sess.run(ops, feed_dict=feed_dict)
-            writer.add_summary(summary, epoch)
-        else:
-            ops = [loss, loss_minimize]
-            loss_np, _ = sess.run(ops, feed_dict=feed_dict)
-
-        losses.append(loss_np)
-
-        print('Iteration %d, loss = %.4f' % (t, loss_np))
-        t += 1
+    try:
+      for epoch in range(num_epochs):
+        print('Starting epoch %d' % epoch)
+
+        # Re-sample train and validation datasets for each epoch
+        train_dset, val_dset = split_train_val(X_train_initial, y_train_initial, validation_cutoff)
+
+        if epoch != 0:
+          # Check training and validation accuracies, and save the model in the background
+          with timer.stage('checkpoint'):
+            async_saver.save(training_checkpoint)
+
+          with timer.stage('evaluation'):
+            accuracies = _check_acc({'Train': train_dset, 'Val': val_dset}, pipeline)
+          train_acc, val_acc = accuracies['Train'], accuracies['Val']
+
+          with timer.stage('stats'):
+            stats.append('train_acc', train_acc)
+            stats.append('val_acc', val_acc)
+            stats.flush()
+
+        train_batches = _batches(train_dset, batch_size)
+        train_inputs = Prefetcher(train_batches, pipeline.preprocess_batch, depth=prefetch_depth)
+        wait_time = train_inputs.wait_time
+        for batch, (rgb, flow, prep_timings) in train_inputs:
+          timer.add_all(prep_timings)
+          timer.add('input_wait', train_inputs.wait_time - wait_time)
+          wait_time = train_inputs.wait_time
+
+          # RGB stays uint8 in the cache and the prefetch queue until here
+          with timer.stage('rgb_to_float'):
+            rgb = rgb_to_float(rgb)
+
+          feed_dict = {
+            learning_rate: lr,
+            rgb_input: rgb,
+            flow_input: flow,
+            y: np.array([y_class for _, y_class in batch]),
+            is_training: 1
+          }
+
+          options, run_metadata = profiler.run_args(t) if profiler else (None, None)
+          with timer.stage('sess_run'):
+            if t % _CHECK_EVERY == 0:
+              ops = [loss, loss_minimize, tf_summaries]
+              loss_np, _, summary = sess.run(ops, feed_dict=feed_dict,
+                                             options=options, run_metadata=run_metadata)
+            else:
+              ops = [loss, loss_minimize]
+              loss_np, _ = sess.run(ops, feed_dict=feed_dict,
+                                    options=options, run_metadata=run_metadata)
+
+          if run_metadata is not None:
+            with timer.stage('profiling'):
+              profiler.add(t, run_metadata, writer)
+
+          with timer.stage('summaries'):
+            if t % _CHECK_EVERY == 0:
+              writer.add_summary(summary, epoch)
+            stats.append('loss', loss_np)
+
+          print('Iteration %d, loss = %.4f' % (t, loss_np))
+          timer.end_step(writer, t)
+          t += 1
+
+          if t % _TIMING_EVERY == 0:
+            print(timer.table())
+
+        tf.logging.info(train_inputs.report('Epoch %d' % epoch))
+        tf.logging.info('Time per stage after epoch %d:\n%s' % (epoch, timer.table()))
+        if profiler and profiler.num_steps:
+          tf.logging.info('Cost per endpoint after epoch %d:\n%s' % (epoch, profiler.table()))
+          tf.logging.info('Endpoint costs written to %s' % profiler.save())
+        if backbone_profiler and backbone_profiler.num_steps:
+          tf.logging.info('Cost per endpoint of the backbone after epoch %d:\n%s' % (
+            epoch, backbone_profiler.table()))
+          tf.logging.info('Backbone costs written to %s' % backbone_profiler.save())
+        elif backbone_profiler and epoch == 0:
+          tf.logging.warning('The backbone was not profiled, as all features were cached in %s'
+                             % cache_dir)
+    finally:
+      try:
+        # Checkpoints are saved at the start of each epoch, so the last one is saved here
+        async_saver.save(training_checkpoint)
+      finally:
+        async_saver.close()
+        stats.close()
 
 
 if __name__ == '__main__':